@@ -0,0 +1,177 @@
+# Los módulos del ETL (y los que los importan: generador y base sustituta) leen su configuración al importarse, por
+# eso se importan dentro de las funciones, después de apuntar el entorno a los sustitutos locales
+from benchmarks.sftp_standin import StandinSFTPServer
+from benchmarks.results import DIR_RESULTS, save_results
+
+from typing import Any, Dict, List
+from pathlib import Path
+
+import argparse
+import tempfile
+import hashlib
+import time
+import os
+
+
+# Variables de configuración del ETL que se guardan junto con los resultados
+REPORTED_SETTINGS = [
+    "ORCHESTRATION_MODE", "TRANSFORM_MODE", "EXTRACT_MODE", "STAGE_HANDOFF", "TRANSFORM_EXECUTOR", "BULK_LOADER",
+    "FILES_IN_FLIGHT", "DB_CONCURRENCY_LIMIT", "SFTP_CONCURRENCY_LIMIT", "CPU_CONCURRENCY_LIMIT", "ADAPTIVE_LIMITS",
+    "COALESCE_VISITORS", "BATCH_SMALL_FILE_BYTES", "SHARD_THRESHOLD_BYTES", "DEDUPLICATE_ROWS", "COMPACT_DTYPES"
+]
+
+
+def seed_sftp_root(sftp_root: Path, n_files: int, n_rows: int, checksums: bool, generator_options: dict) -> List[Path]:
+    """ Genera los reportes sintéticos en el directorio que sirve el SFTP sustituto y, si se pide, publica el
+    sha256 de cada uno en su archivo hermano '.sha256' para que la extracción verifique la descarga """
+    from benchmarks.synthetic import write_report_files
+
+    filepaths = write_report_files(sftp_root, n_files, n_rows, **generator_options)
+    if checksums:
+        for filepath in filepaths:
+            sha256 = hashlib.sha256(filepath.read_bytes()).hexdigest()
+            Path(f"{filepath}.sha256").write_text(f"{sha256}  {filepath.name}\n")
+    return filepaths
+
+
+def configure_environment(workspace: Path, sftp_port: int, retry_delay: int) -> None:
+    """ Apunta el ETL a los sustitutos locales (SFTP, base de visitas, manifiesto) y a directorios dentro del espacio
+    de trabajo. Se llama antes de importar los flujos porque su configuración se lee al importarlos """
+    from benchmarks.standin_db import standin_connection_url
+
+    os.environ.update({
+        "HOST_SFTP": "127.0.0.1",
+        "PORT_SFTP": str(sftp_port),
+        "USER_SFTP": "etl",
+        "PASSWORD_SFTP": "etl",
+        "DIR_SFTP": "/",
+        "DATABASE_URL": standin_connection_url(workspace / "visitas.db") + "?timeout=60",
+        "MANIFEST_DB": str(workspace / "manifest.db"),
+        "DIR_BACKUP": str(workspace / "backup"),
+        "DIR_LOGS": str(workspace / "logs"),
+        "DIR_STAGE_OUTPUTS": str(workspace / "staging_path"),
+        "DIR_VISITOR_DELTAS": str(workspace / "visitor_deltas"),
+        "RETRY_DELAY_SECONDS": str(retry_delay)
+    })
+    os.chdir(workspace)     # la extracción descarga a 'staging_path' relativo al directorio de trabajo
+
+
+def run_orchestration() -> Dict[str, Any]:
+    """ Corre el flujo de orquestación completo y regresa su duración y, si falló, el error. Antes se corre un flujo
+    vacío para que el arranque del servidor de Prefect no cuente en la medición """
+    from flows.orchestrator_flow import etl_flow_orchestration
+    from prefect import flow
+
+    flow(name="calentamiento del arnés")(lambda: None)()
+
+    start = time.perf_counter()
+    error = None
+    try:
+        etl_flow_orchestration()
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+
+    return {"start": start, "seconds": time.perf_counter() - start, "error": error}
+
+
+def collect_metrics(run: Dict[str, Any], server: StandinSFTPServer, db_path: Path, n_files: int) -> Dict[str, Any]:
+    """ Calcula el throughput de la corrida (archivos/hora, registros/segundo) y la latencia por archivo, medida en el
+    SFTP sustituto desde la primera lectura del archivo hasta que post-procesamiento lo borra """
+    from benchmarks.standin_db import create_standin_engine
+    from utils.utils_load import VISITORS_DELTAS_STATUS
+    from sqlalchemy import text
+    import numpy as np
+
+    state = server.state
+    latencies = [state.removed[filename] - state.first_open[filename] for filename in state.removed if filename in state.first_open]
+
+    engine = create_standin_engine(db_path)
+    with engine.connect() as conn:
+        # los registros de deltas de visitantes aplicados (modo coalescido) no corresponden a archivos
+        loaded_files, valid_records, invalid_records = conn.execute(text(
+            "SELECT COUNT(*), COALESCE(SUM(registrosExitosos), 0), COALESCE(SUM(registrosFallidos), 0) FROM bitacora "
+            "WHERE estatus <> :deltas_status"
+        ), {"deltas_status": VISITORS_DELTAS_STATUS}).one()
+    engine.dispose()
+
+    seconds = run["seconds"]
+    records = valid_records + invalid_records
+    return {
+        "segundos": seconds,
+        "archivos": n_files,
+        "archivos_completados": len(state.removed),
+        "archivos_en_bitacora": loaded_files,
+        "archivos_por_hora": len(state.removed) / seconds * 3600 if seconds > 0 else None,
+        "registros": records,
+        "registros_validos": valid_records,
+        "registros_por_segundo": records / seconds if seconds > 0 else None,
+        "latencia_p50": float(np.percentile(latencies, 50)) if latencies else None,
+        "latencia_p95": float(np.percentile(latencies, 95)) if latencies else None,
+        "latencia_max": max(latencies) if latencies else None,
+        "fallas_inyectadas": state.injected_failures,
+        "error": run["error"]
+    }
+
+
+def print_metrics(metrics: Dict[str, Any]) -> None:
+    """ Imprime el resumen de la corrida """
+    def seconds(value):
+        return f"{value:.2f}s" if value is not None else "-"
+
+    print(f"Archivos completados: {metrics['archivos_completados']} de {metrics['archivos']} en {metrics['segundos']:.1f}s")
+    print(f"Throughput: {metrics['archivos_por_hora'] or 0:,.0f} archivos/hora, {metrics['registros_por_segundo'] or 0:,.0f} registros/s")
+    print(f"Latencia por archivo: p50 {seconds(metrics['latencia_p50'])}, p95 {seconds(metrics['latencia_p95'])}, máx. {seconds(metrics['latencia_max'])}")
+    print(f"Fallas de red inyectadas: {metrics['fallas_inyectadas']}")
+    if metrics["error"]:
+        print(f"La orquestación terminó con error: {metrics['error']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Arnés de extremo a extremo: SFTP y base de datos sustitutos locales")
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=50_000, help="registros por archivo")
+    parser.add_argument("--error-rate", type=float, default=0.10)
+    parser.add_argument("--email-skew", type=float, default=1.1)
+    parser.add_argument("--sentinel-rate", type=float, default=0.05)
+    parser.add_argument("--no-checksums", action="store_true", help="no publicar archivos '.sha256' en el SFTP")
+    parser.add_argument("--read-latency-ms", type=float, default=0.0, help="retardo del servidor por cada lectura")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="probabilidad de que una transferencia se corte")
+    parser.add_argument("--retry-delay", type=int, default=1, help="segundos entre reintentos de tareas (RETRY_DELAY_SECONDS)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workspace", type=Path, default=None, help="directorio de trabajo (por defecto, uno temporal)")
+    parser.add_argument("--output-dir", type=Path, default=DIR_RESULTS)
+    args = parser.parse_args()
+
+    output_dir = args.output_dir.resolve()
+    workspace = (args.workspace or Path(tempfile.mkdtemp(prefix="etl_e2e_"))).resolve()
+    sftp_root = workspace / "sftp"
+    sftp_root.mkdir(parents=True, exist_ok=True)
+
+    # 1. sustitutos locales: el puerto del SFTP se conoce al iniciarlo y se configura antes de importar el ETL
+    server = StandinSFTPServer(sftp_root, args.read_latency_ms / 1000, args.failure_rate, args.seed).start()
+    configure_environment(workspace, server.port, args.retry_delay)
+    print(f"SFTP sustituto en 127.0.0.1:{server.port}, espacio de trabajo {workspace}")
+
+    from benchmarks.standin_db import create_standin_engine
+    create_standin_engine(workspace / "visitas.db").dispose()
+
+    # 2. archivos de entrada
+    generator_options = {"error_rate": args.error_rate, "email_skew": args.email_skew, "sentinel_rate": args.sentinel_rate}
+    seed_sftp_root(sftp_root, args.files, args.rows, not args.no_checksums, {"seed": args.seed, **generator_options})
+
+    # 3. corrida completa del orquestador
+    try:
+        run = run_orchestration()
+    finally:
+        server.stop()
+
+    # 4. métricas
+    metrics = collect_metrics(run, server, workspace / "visitas.db", args.files)
+    print_metrics(metrics)
+
+    output_path = save_results("bench_end_to_end", {
+        "opciones": {key: (str(value) if isinstance(value, Path) else value) for key, value in vars(args).items()},
+        "configuracion": {setting: os.getenv(setting) for setting in REPORTED_SETTINGS if os.getenv(setting) is not None},
+        "metricas": metrics
+    }, output_dir)
+    print(f"Resultados guardados en {output_path}")
@@ -0,0 +1,178 @@
+import os
+os.environ.setdefault("DEDUPLICATE_ROWS", "false")     # el benchmark no consulta ni escribe el índice de registros
+
+from benchmarks.synthetic import write_report_files
+from benchmarks.standin_db import create_standin_engine
+from benchmarks.results import DIR_RESULTS, save_results
+from utils.utils_transform import validate_file_loading, validate_file_layout, validate_data_quality, prepare_data
+from utils.utils_load import BULK_LOADERS, bulk_insert, load_staging_visitors_table, load_log_table
+from utils.utils_postprocessing import zip_compress
+
+from typing import Callable, Dict, List, Tuple
+from pathlib import Path
+
+import argparse
+import tempfile
+import logging
+import platform
+import shutil
+import json
+import time
+import sys
+
+import pandas as pd
+
+
+def timed(function: Callable[[], object]) -> float:
+    """ Mide los segundos que tarda una función """
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def bench_transform(filepath: Path, logger: logging.Logger) -> Tuple[Dict[str, float], tuple]:
+    """ Mide la lectura, la validación y la preparación de un archivo; regresa los segundos por paso y deja las
+    tablas preparadas para medir la carga """
+    state = {}
+    seconds = {
+        "lectura": timed(lambda: state.update(file_df=validate_file_loading(filepath, logger))),
+        "layout": timed(lambda: validate_file_layout(state["file_df"], logger)),
+        "validación": timed(lambda: state.update(partitions=validate_data_quality(state["file_df"], logger))),
+        "preparación": timed(lambda: state.update(tables=prepare_data(filepath.name, *state["partitions"], logger)))
+    }
+    return seconds, state["tables"]
+
+
+def bench_load(tables: tuple, loaders: List[str], db_dir: Path, filename: str) -> Dict[str, float]:
+    """ Mide las funciones de carga contra la base embebida (sqlite): 'estadisticas' y 'errores' con cada estrategia
+    de carga, el upsert de visitantes y el registro de bitácora. Cada estrategia usa una base nueva; los visitantes se
+    cargan primero porque 'estadisticas' los referencia """
+    stats_df, visitors_df, errors_df = tables
+    seconds = {}
+    for loader in loaders:
+        engine = create_standin_engine(db_dir / f"standin_{loader}.db")
+        with engine.begin() as conn:
+            seconds[f"carga visitantes ({loader})"] = timed(lambda: load_staging_visitors_table(visitors_df, conn))
+            seconds[f"carga estadisticas ({loader})"] = bulk_insert(stats_df, "estadisticas", conn, loader)
+            seconds[f"carga errores ({loader})"] = bulk_insert(errors_df, "errores", conn, loader) if len(errors_df) > 0 else 0.0
+            seconds[f"carga bitácora ({loader})"] = timed(lambda: load_log_table(filename, len(stats_df), len(errors_df), conn))
+        engine.dispose()
+
+    return seconds
+
+
+def bench_zip(filepath: Path, n_files: int, backup_dir: Path) -> float:
+    """ Mide zip_compress sobre 'n_files' copias del archivo en un directorio de backup temporal """
+    backup_dir.mkdir(parents=True, exist_ok=True)
+    for file_number in range(n_files):
+        shutil.copyfile(filepath, backup_dir / f"report_{file_number + 1}.txt")
+
+    previous_backup_dir = os.environ.get("DIR_BACKUP")
+    os.environ["DIR_BACKUP"] = str(backup_dir)
+    try:
+        return timed(zip_compress)
+    finally:
+        if previous_backup_dir is None:
+            os.environ.pop("DIR_BACKUP")
+        else:
+            os.environ["DIR_BACKUP"] = previous_backup_dir
+        shutil.rmtree(backup_dir)
+
+
+def run_suite(rows: List[int], repeat: int, loaders: List[str], zip_files: int, generator_options: dict, logger: logging.Logger) -> List[dict]:
+    """ Corre todos los pasos para cada tamaño de archivo y regresa el mejor tiempo de 'repeat' repeticiones por paso """
+    results = []
+    for n_rows in rows:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_path = Path(tmp_dir)
+            filepath = write_report_files(tmp_path / "sftp", 1, n_rows, **generator_options)[0]
+
+            best: Dict[str, float] = {}
+            for run in range(repeat):
+                transform_seconds, tables = bench_transform(filepath, logger)
+                load_seconds = bench_load(tables, loaders, tmp_path / f"db_{run}", filepath.name)
+                zip_seconds = {"compresión zip": bench_zip(filepath, zip_files, tmp_path / "backup")}
+
+                for step, seconds in {**transform_seconds, **load_seconds, **zip_seconds}.items():
+                    best[step] = min(best.get(step, seconds), seconds)
+
+        for step, seconds in best.items():
+            results.append({
+                "paso": step,
+                "registros": n_rows,
+                "segundos": seconds,
+                "registros_por_segundo": n_rows / seconds if seconds > 0 else None
+            })
+
+    return results
+
+
+def compare_results(results: List[dict], baseline_path: Path, tolerance: float) -> List[dict]:
+    """ Compara los resultados contra una corrida anterior e imprime el cambio por paso. Regresa los pasos más lentos
+    que la referencia por más de 'tolerance' (fracción) """
+    baseline = json.loads(baseline_path.read_text())
+    baseline_seconds = {(result["paso"], result["registros"]): result["segundos"] for result in baseline["resultados"]}
+    print(f"\nComparación contra {baseline_path.name} (commit {baseline.get('commit')}, versión {baseline.get('version_codigo')})")
+    print(f"{'registros':>12} {'paso':>32} {'referencia s':>13} {'actual s':>10} {'cambio':>8}")
+
+    regressions = []
+    for result in results:
+        previous = baseline_seconds.get((result["paso"], result["registros"]))
+        if not previous:
+            continue
+
+        change = result["segundos"] / previous - 1
+        flag = "  <-- regresión" if change > tolerance else ""
+        print(f"{result['registros']:>12,} {result['paso']:>32} {previous:>13.3f} {result['segundos']:>10.3f} {change:>+8.1%}{flag}")
+        if change > tolerance:
+            regressions.append(result)
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark por etapa: lectura, validación, preparación, carga y zip")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3, help="repeticiones por paso; se reporta la mejor")
+    parser.add_argument("--loaders", nargs="+", default=["executemany"], choices=[loader for loader in BULK_LOADERS if loader != "infile"])
+    parser.add_argument("--zip-files", type=int, default=5, help="copias del archivo que se comprimen en el paso zip")
+    parser.add_argument("--error-rate", type=float, default=0.10)
+    parser.add_argument("--distinct-emails", type=int, default=None)
+    parser.add_argument("--email-skew", type=float, default=1.1)
+    parser.add_argument("--invalid-email-rate", type=float, default=0.0)
+    parser.add_argument("--invalid-date-rate", type=float, default=0.0)
+    parser.add_argument("--sentinel-rate", type=float, default=0.05)
+    parser.add_argument("--output-dir", type=Path, default=DIR_RESULTS)
+    parser.add_argument("--baseline", type=Path, default=None, help="resultados anteriores (JSON) contra los que comparar")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="aumento de tiempo tolerado antes de marcar regresión")
+    args = parser.parse_args()
+
+    generator_options = {
+        "error_rate": args.error_rate,
+        "distinct_emails": args.distinct_emails,
+        "email_skew": args.email_skew,
+        "invalid_email_rate": args.invalid_email_rate,
+        "invalid_date_rate": args.invalid_date_rate,
+        "sentinel_rate": args.sentinel_rate
+    }
+    logger = logging.getLogger("benchmark")
+
+    results = run_suite(args.rows, args.repeat, args.loaders, args.zip_files, generator_options, logger)
+
+    print(f"{'registros':>12} {'paso':>32} {'segundos':>10} {'registros/s':>14}")
+    for result in results:
+        throughput = f"{result['registros_por_segundo']:>14,.0f}" if result["registros_por_segundo"] else f"{'-':>14}"
+        print(f"{result['registros']:>12,} {result['paso']:>32} {result['segundos']:>10.3f} {throughput}")
+
+    options = {"rows": args.rows, "repeat": args.repeat, "loaders": args.loaders, "zip_files": args.zip_files, **generator_options}
+    output_path = save_results("bench_stages", {
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "opciones": options,
+        "resultados": results
+    }, args.output_dir)
+    print(f"\nResultados guardados en {output_path}")
+
+    # salida con error si hay regresiones, para usarse en CI
+    if args.baseline is not None and compare_results(results, args.baseline, args.tolerance):
+        sys.exit(1)
@@ -0,0 +1,105 @@
+import os
+os.environ.setdefault("DEDUPLICATE_ROWS", "false")     # el benchmark no consulta ni escribe el índice de registros
+
+from benchmarks.synthetic import make_report_df
+from utils.utils_transform import validate_file_loading, validate_file_layout, validate_data_quality, prepare_data
+
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import logging
+import time
+from pathlib import Path
+
+
+# Tamaño de página para convertir /proc/self/statm a bytes
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def current_rss() -> int:
+    """ Regresa la memoria residente (RSS) actual del proceso en bytes (Linux) """
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * PAGE_SIZE
+
+
+class PeakRSSSampler:
+    """ Muestrea la RSS del proceso en un hilo aparte mientras dura el bloque 'with' y guarda el máximo observado """
+
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.start_rss = 0
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self) -> None:
+        while not self._stop.is_set():
+            self.peak_rss = max(self.peak_rss, current_rss())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.start_rss = self.peak_rss = current_rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak_rss = max(self.peak_rss, current_rss())
+
+
+def run_stages(filepath: Path, logger: logging.Logger):
+    """ Ejecuta la etapa de transformación dividida en sus pasos, entregando (nombre, función) para medir cada uno """
+    state = {}
+    yield "lectura", lambda: state.update(file_df=validate_file_loading(filepath, logger))
+    yield "layout", lambda: validate_file_layout(state["file_df"], logger)
+    yield "validación", lambda: state.update(partitions=validate_data_quality(state["file_df"], logger))
+    yield "preparación", lambda: prepare_data(filepath.name, *state["partitions"], logger)
+
+
+def bench_peak_rss(filepath: Path, logger: logging.Logger) -> dict:
+    """ Mide el pico de RSS (MB, absoluto y sobre el inicio del paso) de cada paso de la transformación """
+    results = {}
+    for stage, run in run_stages(filepath, logger):
+        with PeakRSSSampler() as sampler:
+            run()
+        results[stage] = (sampler.peak_rss / 1024 ** 2, (sampler.peak_rss - sampler.start_rss) / 1024 ** 2)
+    return results
+
+
+def bench_allocations(filepath: Path, logger: logging.Logger) -> dict:
+    """ Mide con tracemalloc el pico de memoria asignada (MB) por cada paso de la transformación. Se corre aparte de
+    la medición de RSS porque el rastreo de asignaciones ocupa memoria propia """
+    results = {}
+    tracemalloc.start()
+    for stage, run in run_stages(filepath, logger):
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+        results[stage] = (peak - start) / 1024 ** 2
+    tracemalloc.stop()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de memoria pico de la etapa de transformación")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--error-rate", type=float, default=0.10)
+    args = parser.parse_args()
+
+    logger = logging.getLogger("benchmark")
+
+    print(f"{'registros':>12} {'paso':>12} {'RSS pico MB':>12} {'Δ RSS MB':>10} {'asignado MB':>12}")
+    for n_rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # el archivo sintético se escribe a disco para incluir la lectura en la medición
+            filepath = Path(tmp_dir) / "report_bench.txt"
+            make_report_df(n_rows, args.error_rate).to_csv(filepath, index=False)
+
+            rss = bench_peak_rss(filepath, logger)
+            allocations = bench_allocations(filepath, logger)
+
+        for stage, (peak_mb, delta_mb) in rss.items():
+            print(f"{n_rows:>12,} {stage:>12} {peak_mb:>12,.1f} {delta_mb:>10,.1f} {allocations[stage]:>12,.1f}")
@@ -0,0 +1,31 @@
+from benchmarks.synthetic import make_report_df
+from utils.utils_transform import validate_data_quality
+
+import argparse
+import logging
+import time
+
+
+def bench_validate_data_quality(n_rows: int, error_rate: float) -> float:
+    """ Mide el throughput (registros/segundo) de validate_data_quality para un tamaño y tasa de error dados """
+    report_df = make_report_df(n_rows, error_rate)
+    logger = logging.getLogger("benchmark")
+
+    start = time.perf_counter()
+    validate_data_quality(report_df, logger)
+    elapsed = time.perf_counter() - start
+
+    return n_rows / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de validate_data_quality")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000_000, 10_000_000])
+    parser.add_argument("--error-rates", type=float, nargs="+", default=[0.01, 0.10, 0.50])
+    args = parser.parse_args()
+
+    print(f"{'registros':>12} {'tasa error':>10} {'registros/s':>14}")
+    for n_rows in args.rows:
+        for error_rate in args.error_rates:
+            throughput = bench_validate_data_quality(n_rows, error_rate)
+            print(f"{n_rows:>12,} {error_rate:>10.0%} {throughput:>14,.0f}")
@@ -0,0 +1,66 @@
+from benchmarks.synthetic import make_report_df
+from utils.utils_transform import DATE_COLUMNS, validate_email_column, parse_date_column, is_valid_email
+
+import pandas as pd
+import argparse
+import time
+
+
+# Patrones de la implementación anterior (regex por registro sobre columnas normalizadas varias veces)
+LEGACY_EMAIL_PATTERN = r"^[a-zA-Z0-9][a-zA-Z0-9._%+-]*@[a-zA-Z0-9]([a-zA-Z0-9-]*[a-zA-Z0-9])?(\.[a-zA-Z0-9]([a-zA-Z0-9-]*[a-zA-Z0-9])?)*\.[a-zA-Z]{2,}$"
+LEGACY_DATE_PATTERN = r"^(0[1-9]|[12][0-9]|3[01])/(0[1-9]|1[0-2])/\d{4}\s([01][0-9]|2[0-3]):[0-5][0-9]$"
+
+
+def legacy_validation(report_df: pd.DataFrame) -> pd.Series:
+    """ Validación de emails y fechas tal como la hacía validate_data_quality antes del motor compilado """
+    valid = (
+        report_df["email"].notna() &
+        report_df["email"].astype(str).str.strip().ne("") &
+        report_df["email"].astype(str).str.strip().str.match(LEGACY_EMAIL_PATTERN, na=False)
+    )
+    for column_name in DATE_COLUMNS:
+        valid &= (
+            report_df[column_name].isna() |
+            (
+                report_df[column_name].notna() &
+                report_df[column_name].astype(str).str.strip().ne("") &
+                report_df[column_name].astype(str).str.strip().str.match(LEGACY_DATE_PATTERN, na=False)
+            )
+        )
+    return valid
+
+
+def engine_validation(report_df: pd.DataFrame) -> pd.Series:
+    """ Validación de emails y fechas con el motor compilado y con caché (las fechas quedan además tipadas) """
+    valid = validate_email_column(report_df["email"])
+    for column_name in DATE_COLUMNS:
+        _, valid_dates = parse_date_column(report_df[column_name])
+        valid &= valid_dates
+    return valid
+
+
+def timed(function, report_df: pd.DataFrame) -> float:
+    """ Mide los segundos que tarda una función de validación """
+    start = time.perf_counter()
+    function(report_df)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark del motor de validación contra la implementación anterior")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--error-rate", type=float, default=0.10)
+    args = parser.parse_args()
+
+    print(f"{'registros':>12} {'anterior (s)':>13} {'motor frío (s)':>15} {'motor caché (s)':>16} {'speedup':>8}")
+    for n_rows in args.rows:
+        report_df = make_report_df(n_rows, args.error_rate)
+
+        # validamos que ambas implementaciones den el mismo veredicto
+        assert legacy_validation(report_df).equals(engine_validation(report_df))
+
+        is_valid_email.cache_clear()
+        legacy_seconds = timed(legacy_validation, report_df)
+        cold_seconds = timed(engine_validation, report_df)
+        warm_seconds = timed(engine_validation, report_df)   # mismos emails: veredictos ya en caché
+        print(f"{n_rows:>12,} {legacy_seconds:>13.2f} {cold_seconds:>15.2f} {warm_seconds:>16.2f} {legacy_seconds / cold_seconds:>7.1f}x")
@@ -0,0 +1,43 @@
+from typing import Any, Dict, Optional
+from pathlib import Path
+
+import subprocess
+import datetime
+import json
+
+
+# Directorio por defecto de los resultados guardados
+DIR_RESULTS = Path(__file__).parent / "results"
+
+# Archivos del código medido; su hash identifica la versión en los resultados
+ROOT_DIR = Path(__file__).parents[1]
+MEASURED_SOURCES = sorted((ROOT_DIR / "utils").glob("utils_*.py")) + sorted((ROOT_DIR / "tasks").glob("*.py"))
+
+
+def git_revision() -> Optional[str]:
+    """ Regresa el commit actual del repositorio, o None si no está disponible """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(name: str, report: Dict[str, Any], output_dir: Path) -> Path:
+    """ Guarda un reporte de benchmark como JSON con fecha en 'output_dir', agregando la fecha, el commit y la versión
+    del código medido. Los módulos del ETL se importan aquí y no al inicio, porque leen su configuración al importarse """
+    from utils.utils_flows import code_version
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    now = datetime.datetime.now()
+    report = {
+        "fecha": now.isoformat(timespec="seconds"),
+        "commit": git_revision(),
+        "version_codigo": code_version(*MEASURED_SOURCES)[:12],
+        **report
+    }
+
+    output_path = output_dir / f"{name}_{now.strftime('%Y%m%d_%H%M%S')}.json"
+    output_path.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    return output_path
@@ -0,0 +1,174 @@
+from paramiko import SFTPServerInterface, SFTPServer, SFTPAttributes, SFTPHandle
+from paramiko import SFTP_OK, SFTP_FAILURE, AUTH_SUCCESSFUL, OPEN_SUCCEEDED
+from typing import Dict, Optional
+from pathlib import Path
+
+import threading
+import paramiko
+import random
+import socket
+import time
+import os
+
+
+class StandinServerState:
+    """ Configuración y eventos compartidos por las sesiones del servidor: directorio raíz, retardo por lectura,
+    probabilidad de falla por transferencia y los tiempos de primera lectura y de borrado de cada reporte """
+
+    def __init__(self, root: Path, read_latency: float = 0.0, failure_rate: float = 0.0, seed: int = 0):
+        self.root = Path(root)
+        self.read_latency = read_latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.first_open: Dict[str, float] = {}
+        self.removed: Dict[str, float] = {}
+        self.injected_failures = 0
+        self.lock = threading.Lock()
+
+    def should_fail(self) -> bool:
+        """ Decide si la transferencia que empieza se corta a la mitad """
+        with self.lock:
+            fail = self.random.random() < self.failure_rate
+            self.injected_failures += fail
+            return fail
+
+
+class StandinHandle(SFTPHandle):
+    """ Archivo abierto en el servidor; cada lectura espera 'read_latency'. En la primera lectura de un reporte se
+    registra su tiempo y se decide si la transferencia falla; si falla, las lecturas desde la mitad regresan error """
+
+    def __init__(self, flags: int, state: StandinServerState, local_path: Path):
+        super().__init__(flags)
+        self.state = state
+        self.local_path = local_path
+        self.fail_at: Optional[int] = None
+        self._started = False
+
+    def stat(self):
+        return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+    def read(self, offset: int, length: int):
+        if not self._started and self.local_path.suffix == ".txt":
+            self._started = True
+            with self.state.lock:
+                self.state.first_open.setdefault(self.local_path.name, time.perf_counter())
+            if self.state.should_fail():
+                self.fail_at = self.local_path.stat().st_size // 2
+
+        if self.state.read_latency > 0:
+            time.sleep(self.state.read_latency)
+        if self.fail_at is not None and offset + length > self.fail_at:
+            return SFTP_FAILURE
+        return super().read(offset, length)
+
+
+class StandinSFTPInterface(SFTPServerInterface):
+    """ Interfaz SFTP de sólo lo que usa el ETL (listar, stat, abrir, borrar) sobre un directorio local """
+
+    def __init__(self, server, state: StandinServerState, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.state = state
+
+    def _local_path(self, path: str) -> Path:
+        return self.state.root / self.canonicalize(path).lstrip("/")
+
+    def canonicalize(self, path: str) -> str:
+        return os.path.normpath("/" + path)
+
+    def list_folder(self, path: str):
+        attributes = []
+        for entry in self._local_path(path).iterdir():
+            attr = SFTPAttributes.from_stat(entry.stat())
+            attr.filename = entry.name
+            attributes.append(attr)
+        return attributes
+
+    def stat(self, path: str):
+        try:
+            return SFTPAttributes.from_stat(self._local_path(path).stat())
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path: str, flags: int, attr):
+        if flags & (os.O_WRONLY | os.O_RDWR):
+            return SFTP_FAILURE     # el servidor de inicio es de sólo lectura para el ETL
+
+        local_path = self._local_path(path)
+        try:
+            file = open(local_path, "rb")
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+        handle = StandinHandle(flags, self.state, local_path)
+        handle.filename = str(local_path)
+        handle.readfile = file
+        return handle
+
+    def remove(self, path: str):
+        local_path = self._local_path(path)
+        try:
+            local_path.unlink()
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+        with self.state.lock:
+            self.state.removed[local_path.name] = time.perf_counter()
+        return SFTP_OK
+
+
+class StandinSSHServer(paramiko.ServerInterface):
+    """ Acepta cualquier usuario y contraseña y sólo el subsistema sftp """
+
+    def check_auth_password(self, username: str, password: str) -> int:
+        return AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username: str) -> str:
+        return "password"
+
+    def check_channel_request(self, kind: str, chanid: int) -> int:
+        return OPEN_SUCCEEDED
+
+
+class StandinSFTPServer:
+    """ Servidor SFTP en proceso (paramiko) que sirve un directorio local en 127.0.0.1 y sustituye al servidor de
+    inicio en el arnés de extremo a extremo. Puede agregar retardo por lectura y cortar transferencias al azar """
+
+    def __init__(self, root: Path, read_latency: float = 0.0, failure_rate: float = 0.0, seed: int = 0):
+        self.state = StandinServerState(root, read_latency, failure_rate, seed)
+        self._host_key = paramiko.RSAKey.generate(2048)
+        self._socket = socket.socket()
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._transports = []
+        self._thread = threading.Thread(target=self._accept_loop, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self._socket.getsockname()[1]
+
+    def start(self) -> "StandinSFTPServer":
+        """ Empieza a aceptar conexiones en un puerto libre """
+        self._socket.bind(("127.0.0.1", 0))
+        self._socket.listen(100)
+        self._thread.start()
+        return self
+
+    def _accept_loop(self) -> None:
+        while True:
+            try:
+                client, _ = self._socket.accept()
+            except OSError:
+                return  # el socket se cerró
+
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self._host_key)
+            transport.set_subsystem_handler("sftp", SFTPServer, StandinSFTPInterface, self.state)
+            transport.start_server(server=StandinSSHServer())
+            self._transports.append(transport)
+
+    def stop(self) -> None:
+        """ Deja de aceptar conexiones y cierra las sesiones abiertas """
+        self._socket.close()
+        for transport in self._transports:
+            transport.close()
@@ -0,0 +1,89 @@
+from sqlalchemy import create_engine, text, Engine
+from pathlib import Path
+
+import datetime
+import sqlite3
+
+
+# Esquema de database/schema.sql traducido a sqlite (INTEGER PRIMARY KEY en lugar de AUTO_INCREMENT). La llave foránea
+# de 'estadisticas' se valida en cada sentencia, como en InnoDB, porque el engine activa 'foreign_keys' en sqlite
+STANDIN_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS visitantes (
+        email VARCHAR(255) NOT NULL,
+        fechaPrimeraVisita DATE,
+        fechaUltimaVisita DATE,
+        visitasTotales INT,
+        visitasAnioActual INT,
+        visitasMesActual INT,
+
+        PRIMARY KEY (email)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS estadisticas (
+        idEstadistica INTEGER PRIMARY KEY,
+        email VARCHAR(255),
+        jyv VARCHAR(255),
+        badMail VARCHAR(255),
+        baja VARCHAR(255),
+        fechaEnvio DATETIME,
+        fechaOpen DATETIME,
+        opens INT,
+        opensVirales INT,
+        fechaClick DATETIME,
+        clicks INT,
+        clicksVirales INT,
+        links TEXT,
+        ips VARCHAR(255),
+        navegadores VARCHAR(255),
+        plataformas VARCHAR(255),
+
+        FOREIGN KEY (email) REFERENCES visitantes(email)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS errores (
+        idError INTEGER PRIMARY KEY,
+        nombreArchivo VARCHAR(255),
+        email VARCHAR(255),
+        tipoError VARCHAR(255),
+        fechaError DATE DEFAULT (CURRENT_DATE)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS bitacora (
+        idBitacora INTEGER PRIMARY KEY,
+        fechaProceso DATE DEFAULT (CURRENT_DATE),
+        nombreArchivo VARCHAR(255),
+        registrosExitosos INT,
+        registrosFallidos INT,
+        estatus VARCHAR(255) NOT NULL
+    )
+    """
+]
+
+# las fechas se guardan como texto ISO, el formato que entienden las funciones de fecha de sqlite
+sqlite3.register_adapter(datetime.date, lambda date: date.isoformat())
+
+
+def standin_connection_url(db_path: Path) -> str:
+    """ Regresa el connection string de sqlalchemy de la base embebida """
+    return f"sqlite:///{Path(db_path).resolve()}"
+
+
+def create_standin_engine(db_path: Path) -> Engine:
+    """ Crea (si no existe) una base sqlite con el esquema de la base de visitas y regresa su engine. Sustituye a
+    mysql para medir y probar las funciones de carga sin un servidor """
+    # importamos el ETL hasta aquí: al importarse lee su configuración, y el arnés de punta a punta importa este
+    # módulo antes de apuntar el entorno a los sustitutos locales
+    from utils.utils_load import enable_sqlite_foreign_keys
+
+    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+    engine = create_engine(standin_connection_url(db_path))
+    enable_sqlite_foreign_keys(engine)
+    with engine.begin() as conn:
+        for statement in STANDIN_SCHEMA:
+            conn.execute(text(statement))
+
+    return engine
@@ -0,0 +1,122 @@
+from utils.utils_transform import VALID_COLUMNS, NA_SENTINELS
+from typing import List, Optional
+from pathlib import Path
+
+import pandas as pd
+import numpy as np
+import argparse
+
+
+# Valores inválidos usados para inyectar errores de validación
+INVALID_EMAIL = "usuario@@dominio"
+INVALID_DATE = "2024-13-45 99:99"
+
+# Columnas opcionales donde se inyectan centinelas de nulo ('-', '0'); en las fechas un centinela es error de formato
+SENTINEL_COLUMNS = ["Opens virales", "Clicks virales", "Links", "IPs"]
+
+
+def make_emails(n_rows: int, distinct_emails: int, email_skew: float, rng: np.random.Generator) -> pd.Series:
+    """ Función que genera la columna de emails con 'distinct_emails' usuarios. Con 'email_skew' = 0 los usuarios se
+    reparten de forma uniforme; con 'email_skew' > 0 siguen una ley de Zipf (pocos usuarios concentran las visitas) """
+    if email_skew > 0:
+        weights = 1.0 / np.arange(1, distinct_emails + 1) ** email_skew
+        user_ids = rng.choice(distinct_emails, size=n_rows, p=weights / weights.sum())
+    else:
+        user_ids = rng.integers(0, distinct_emails, size=n_rows)
+
+    return pd.Series(user_ids).astype(str).radd("usuario").add("@dominio.com")
+
+
+def make_report_df(n_rows: int, error_rate: float = 0.0, seed: int = 0, distinct_emails: Optional[int] = None,
+                   email_skew: float = 0.0, invalid_email_rate: float = 0.0, invalid_date_rate: float = 0.0,
+                   sentinel_rate: float = 0.0) -> pd.DataFrame:
+    """ Función que genera un dataframe sintético con el layout de los archivos report_*.txt, donde una fracción
+    'error_rate' de los registros falla alguna validación (email o fechas). Además se pueden inyectar por separado
+    emails inválidos ('invalid_email_rate'), fechas inválidas ('invalid_date_rate') y centinelas de nulo en las
+    columnas opcionales ('sentinel_rate'); 'distinct_emails' y 'email_skew' controlan la repetición de los emails """
+    rng = np.random.default_rng(seed)
+    distinct_emails = distinct_emails or max(n_rows // 10, 1)
+
+    # columnas base válidas
+    emails = make_emails(n_rows, distinct_emails, email_skew, rng)
+    days = rng.integers(1, 29, size=n_rows)
+    report_df = pd.DataFrame({
+        "email": emails,
+        "jyv": "SI",
+        "Badmail": "NO",
+        "Baja": "NO",
+        "Fecha envio": pd.Series(days).map("{:02d}/06/2024 10:15".format),
+        "Fecha open": pd.Series(days).map("{:02d}/06/2024 11:30".format),
+        "Opens": rng.integers(1, 10, size=n_rows),
+        "Opens virales": rng.integers(1, 3, size=n_rows),
+        "Fecha click": pd.Series(days).map("{:02d}/06/2024 12:45".format),
+        "Clicks": rng.integers(1, 10, size=n_rows),
+        "Clicks virales": rng.integers(1, 3, size=n_rows),
+        "Links": "https://sitio.com/promo",
+        "IPs": "10.0.0.1",
+        "Navegadores": rng.choice(["Chrome", "Firefox", "Safari"], size=n_rows),
+        "Plataformas": rng.choice(["Windows", "Android", "iOS"], size=n_rows)
+    }, columns=VALID_COLUMNS)
+
+    # inyectamos errores en una validación aleatoria (email o alguna fecha) de cada registro erróneo
+    error_rows = rng.random(n_rows) < error_rate
+    error_target = rng.integers(0, 4, size=n_rows)
+    report_df.loc[error_rows & (error_target == 0), "email"] = INVALID_EMAIL
+    for target, column_name in enumerate(["Fecha envio", "Fecha open", "Fecha click"], start=1):
+        report_df.loc[error_rows & (error_target == target), column_name] = INVALID_DATE
+
+    # errores independientes por tipo
+    if invalid_email_rate > 0:
+        report_df.loc[rng.random(n_rows) < invalid_email_rate, "email"] = INVALID_EMAIL
+    if invalid_date_rate > 0:
+        report_df.loc[rng.random(n_rows) < invalid_date_rate, "Fecha envio"] = INVALID_DATE
+
+    # centinelas de nulo en las columnas opcionales (se leen como nulos, no son errores)
+    if sentinel_rate > 0:
+        for column_name in SENTINEL_COLUMNS:
+            sentinel_rows = rng.random(n_rows) < sentinel_rate
+            report_df[column_name] = report_df[column_name].astype(object)
+            report_df.loc[sentinel_rows, column_name] = rng.choice(NA_SENTINELS, size=int(sentinel_rows.sum()))
+
+    return report_df
+
+
+def write_report_files(output_dir: Path, n_files: int, n_rows: int, seed: int = 0, **options) -> List[Path]:
+    """ Función que escribe 'n_files' archivos report_*.txt sintéticos de 'n_rows' registros cada uno en 'output_dir'.
+    Cada archivo usa su propia semilla; 'options' son los parámetros de make_report_df """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    filepaths = []
+    for file_number in range(n_files):
+        filepath = output_dir / f"report_{file_number + 1}.txt"
+        make_report_df(n_rows, seed=seed + file_number, **options).to_csv(filepath, index=False)
+        filepaths.append(filepath)
+
+    return filepaths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generador de archivos report_*.txt sintéticos")
+    parser.add_argument("output_dir", type=Path)
+    parser.add_argument("--files", type=int, default=1)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--distinct-emails", type=int, default=None)
+    parser.add_argument("--email-skew", type=float, default=0.0)
+    parser.add_argument("--invalid-email-rate", type=float, default=0.0)
+    parser.add_argument("--invalid-date-rate", type=float, default=0.0)
+    parser.add_argument("--sentinel-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    filepaths = write_report_files(
+        args.output_dir, args.files, args.rows, args.seed,
+        error_rate=args.error_rate,
+        distinct_emails=args.distinct_emails,
+        email_skew=args.email_skew,
+        invalid_email_rate=args.invalid_email_rate,
+        invalid_date_rate=args.invalid_date_rate,
+        sentinel_rate=args.sentinel_rate
+    )
+    print(f"{len(filepaths)} archivos generados en {args.output_dir}")
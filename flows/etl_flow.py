@@ -1,51 +1,194 @@
-from importlib.abc import FileLoader
 from prefect.task_runners import ConcurrentTaskRunner
+from prefect.runtime import flow_run
 from prefect import flow
 from pathlib import Path
+from typing import Any, Dict, List, Optional
 
-from utils.utils import setup_logger
+from utils.utils_flows import TRANSFORM_MODE, RETRY_DELAY_SECONDS, setup_logger
+from utils.utils_extract import RemoteFileSource, file_sha256
+from utils.utils_preprocessing import (
+    DEDUPLICATE_FILES,
+    DEDUPLICATE_ROWS,
+    find_duplicate_file,
+    claim_in_flight_file,
+    release_in_flight_file,
+    reset_pending_rows
+)
+from utils.utils_postprocessing import remove_stage_outputs
 
 from tasks.extract import extract
-from tasks.transform import transform
-from tasks.load import load
+from tasks.transform import transform, transform_batch
+from tasks.load import load, load_batch, load_streaming
 from tasks.post_processing import post_processing
 
 
-@flow(
-    name="Proceso ETL (micro-batch)",
-    task_runner = ConcurrentTaskRunner(max_workers=2),
-    retries=1,
-    retry_delay_seconds=60
-)
-def etl_flow(filepath: str): 
-    """ Este es el flujo que define el procesamiento del ETL por archivo """
-    # Obtener el nombre del file
-    filename = filepath.name
-
-    # pasar filepath string a Path
-    if isinstance(filepath, str):
-        filepath = Path(FileLoader)
-
+def new_etl_job(filename: str, deltas_dir: Optional[str] = None, file_info: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """ Crea el estado del procesamiento de un archivo, que pasa de una etapa a la siguiente """
     # inicializar archivo de logging
     logger = setup_logger(filename)
     logger.info(f"=== Iniciando proceso ETL para archivo: {filename} ===")
 
-    # intentamos correr el flujo ETL
-    try:
-        filepath = extract(filename, logger)    # extract
+    return {"filename": filename, "logger": logger, "deltas_dir": deltas_dir, "file_info": file_info}
+
+
+def extract_stage(job: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """ Etapa de extracción. Regresa None si el archivo es una re-entrega ya procesada (no continúa a la carga) """
+    filename, logger, file_info = job["filename"], job["logger"], job["file_info"]
+    job["filepath"] = extract(filename, logger)    # extract
+
+    # si el servidor no publica checksums, las re-entregas se detectan ya descargadas, contra el manifiesto y contra
+    # los archivos en vuelo de la corrida: se respaldan y se registran en el manifiesto sin volver a cargarlas
+    if DEDUPLICATE_FILES and isinstance(job["filepath"], Path) and (file_info or {}).get("sha256") is None:
+        sha256 = file_sha256(job["filepath"])
+        duplicate_of = find_duplicate_file(sha256) or claim_in_flight_file(sha256, filename)
+        if duplicate_of is not None:
+            logger.warning(f"Advertencia: {filename} es una re-entrega de {duplicate_of}, se omite la carga")
+            post_processing(filename, job["filepath"], logger, file_info)
+            return None
+
+    return job
+
+
+def transform_stage(job: Dict[str, Any]) -> Dict[str, Any]:
+    """ Etapa de transformación. En modo streaming la transformación corre por bloques dentro de la carga """
+    if TRANSFORM_MODE != "streaming":
+        # transform: dataframes en memoria o rutas a las salidas Arrow en staging (STAGE_HANDOFF)
+        job["tables"] = transform(job["filepath"], job["logger"])
+        if job["tables"] is None:
+            raise ValueError(f"El archivo {job['filename']} no generó tablas para cargar")
+
+    return job
+
+
+def load_stage(job: Dict[str, Any]) -> Dict[str, Any]:
+    """ Etapa de carga a MySQL """
+    filename, logger, deltas_dir = job["filename"], job["logger"], job["deltas_dir"]
+    if TRANSFORM_MODE == "streaming":
+        load_streaming(filename, job["filepath"], logger, deltas_dir)  # transform + load por bloques
+    else:
+        stats_df, visitors_df, errors_df = job["tables"]
+        load(filename, stats_df, visitors_df, errors_df, logger, deltas_dir) # load
+
+    return job
+
+
+def post_processing_stage(job: Dict[str, Any]) -> Dict[str, Any]:
+    """ Etapa de post procesamiento: backup, manifiesto y borrado del archivo original """
+    filename, logger, filepath = job["filename"], job["logger"], job["filepath"]
 
-        stats_df, visitors_df, errors_df = transform(filepath, logger)   # transform
+    # en modo stream la copia local (si se pidió) es la que se respalda
+    if isinstance(filepath, RemoteFileSource):
+        filepath = filepath.tee_path
 
-        load(filename, visitors_df, stats_df, errors_df, logger) # load
+    post_processing(filename, filepath, logger, job["file_info"])   # post processing
+    release_in_flight_file(filename)    # el manifiesto ya registra su contenido
+    logger.info(f"=== Archivo {filename} procesado con éxito ===")
+    return job
 
-        post_processing(filepath, logger)   # post processing
-        logger.info(f"=== Archivo {filename} procesado con éxito ===")
+
+def release_failed_file(filename: str) -> None:
+    """ Libera lo que reclamó un archivo que falló definitivamente: sus hashes de registros pendientes (así una
+    re-entrega o el reintento en otra corrida los vuelve a reclamar), su contenido en vuelo y sus salidas en staging,
+    que sin hashes reclamados ya no deben reutilizarse """
+    if DEDUPLICATE_ROWS:
+        reset_pending_rows(filename)
+    release_in_flight_file(filename)
+    remove_stage_outputs(filename)
+
+
+# Etapas del ETL en orden; el flujo por archivo las corre en secuencia y el orquestador en modo pipeline las traslapa
+ETL_STAGES = [
+    ("extracción", extract_stage),
+    ("transformación", transform_stage),
+    ("carga", load_stage),
+    ("post-procesamiento", post_processing_stage)
+]
+
+
+# Reintentos del flujo por archivo
+ETL_FLOW_RETRIES = 1
+
+
+@flow(
+    name="Proceso ETL (micro-batch)",
+    task_runner = ConcurrentTaskRunner(max_workers=2),
+    retries=ETL_FLOW_RETRIES,
+    retry_delay_seconds=RETRY_DELAY_SECONDS
+)
+def etl_flow(filepath: str, deltas_dir: Optional[str] = None, file_info: Optional[Dict[str, Any]] = None):
+    """ Este es el flujo que define el procesamiento del ETL por archivo. Si se recibe 'deltas_dir', el upsert de
+    visitantes se delega al orquestador (deltas coalescidos por corrida). 'file_info' son los metadatos del listado
+    (tamaño, fecha de modificación) con los que el archivo se registra en el manifiesto """
+    # Obtener el nombre del file
+    filename = Path(filepath).name
+    job = new_etl_job(filename, deltas_dir, file_info)
+
+    # intentamos correr el flujo ETL, etapa por etapa
+    try:
+        for _, stage in ETL_STAGES:
+            job = stage(job)
+            if job is None:     # el archivo terminó antes (re-entrega)
+                break
         return True
 
     except Exception as e:
-        logger.error(f"Error: Fallo procesando el archivo: {filename}")
+        setup_logger(filename).error(f"Error: Fallo procesando el archivo: {filename}")
+        # en el último intento liberamos lo que reclamó el archivo; en los anteriores el reintento lo reutiliza
+        if flow_run.run_count > ETL_FLOW_RETRIES:
+            release_failed_file(filename)
         raise e
 
 
+@flow(
+    name="Proceso ETL (lote de archivos pequeños)",
+    task_runner = ConcurrentTaskRunner(max_workers=2)
+)
+def etl_batch_flow(file_infos: List[Dict[str, Any]], deltas_dir: Optional[str] = None):
+    """ Este es el flujo que procesa un micro-lote de archivos pequeños: se descargan uno a uno, se transforman juntos
+    y se cargan en una sola transacción, con un solo log para el lote. 'bitacora' y 'errores' conservan los conteos y
+    el nombre de cada archivo. Un archivo que falla no detiene al resto; el flujo falla al final si hubo alguno. No se
+    reintenta el flujo completo para no volver a cargar los archivos del lote que ya se cargaron """
+    batch_name = f"lote_{Path(file_infos[0]['filename']).stem}_{len(file_infos)}"
+    logger = setup_logger(batch_name)
+    logger.info(f"=== Iniciando proceso ETL para el lote {batch_name}: {', '.join(f['filename'] for f in file_infos)} ===")
+
+    # 1. extracción de cada archivo (las re-entregas se cierran aquí mismo)
+    jobs = []
+    failed_files = []
+    for file_info in file_infos:
+        job = {"filename": file_info["filename"], "logger": logger, "deltas_dir": deltas_dir, "file_info": file_info}
+        try:
+            job = extract_stage(job)
+        except Exception as e:
+            logger.error(f"Error: Fallo la extracción del archivo: {file_info['filename']}. {str(e)}")
+            failed_files.append(file_info["filename"])
+            continue
+
+        if job is not None:
+            jobs.append(job)
+
+    # 2. transformación conjunta y 3. carga en una sola transacción (si falla la carga, fallan todos los archivos)
+    if jobs:
+        tables, record_counts, failed_transform = transform_batch([job["filepath"] for job in jobs], logger)
+        failed_files.extend(failed_transform)
+        if tables is not None:
+            try:
+                load_batch(batch_name, record_counts, *tables, logger, deltas_dir)
+            except Exception:
+                for job in jobs:
+                    release_failed_file(job["filename"])
+                raise
+
+        # 4. post procesamiento de los archivos cargados
+        for job in jobs:
+            if job["filename"] in record_counts:
+                post_processing_stage(job)
 
+    if failed_files:
+        logger.error(f"Error: Fallo procesando los archivos: {', '.join(failed_files)}")
+        for filename in failed_files:
+            release_failed_file(filename)
+        raise RuntimeError(f"Fallaron {len(failed_files)} de {len(file_infos)} archivos del lote {batch_name}")
 
+    logger.info(f"=== Lote {batch_name} procesado con éxito ===")
+    return True
@@ -1,17 +1,80 @@
 from prefect.task_runners import ConcurrentTaskRunner
-from prefect import flow
+from prefect import flow, task
+from typing import Any, Dict, List, Optional, Tuple
 
-from flows.etl_flow import etl_flow
+from flows.etl_flow import ETL_STAGES, etl_flow, etl_batch_flow, new_etl_job, release_failed_file
 
 from tasks.post_processing import compress_backup
 from tasks.pre_processing import list_files
+from tasks.load import apply_visitors_deltas
+
+from utils.utils_load import list_pending_deltas_dirs
+from utils.utils_transform import purge_expired_stage_outputs
+
+from utils.utils_flows import (
+    DB_CONCURRENCY_LIMIT,
+    COALESCE_VISITORS,
+    DIR_VISITOR_DELTAS,
+    SCHEDULE_ORDER,
+    FILES_IN_FLIGHT,
+    RESOURCE_LIMITERS,
+    ORCHESTRATION_MODE,
+    PIPELINE_QUEUE_DEPTH,
+    SFTP_CONCURRENCY_LIMIT,
+    CPU_CONCURRENCY_LIMIT,
+    BATCH_SMALL_FILE_BYTES,
+    StagePipeline,
+    plan_batches
+)
+
+from pathlib import Path
 
+import datetime
 import logging
 
 
+@task(name="procesar archivo")
+def process_file(file_info: Dict[str, Any], deltas_dir: Optional[str]) -> bool:
+    """ Tarea que corre el flujo ETL de un archivo como subflujo, para poder enviar varios archivos a la vez """
+    return etl_flow(file_info["filename"], deltas_dir, file_info)
+
+
+@task(name="procesar lote de archivos")
+def process_batch(file_infos: List[Dict[str, Any]], deltas_dir: Optional[str]) -> bool:
+    """ Tarea que corre el flujo ETL de un micro-lote de archivos pequeños como subflujo """
+    return etl_batch_flow(file_infos, deltas_dir)
+
+
+def run_pipeline(files: List[Dict[str, Any]], deltas_dir: Optional[str], logger: logging.Logger) -> List[Tuple[str, Any, Exception]]:
+    """ Procesa los archivos con las etapas del ETL traslapadas: cada etapa tiene tantos hilos como su recurso permite
+    y las colas entre etapas acotan cuántos archivos se adelantan (p. ej. descargas esperando transformación) """
+    workers = {
+        "extracción": SFTP_CONCURRENCY_LIMIT,
+        "transformación": CPU_CONCURRENCY_LIMIT,
+        "carga": DB_CONCURRENCY_LIMIT,
+        "post-procesamiento": 1
+    }
+    pipeline = StagePipeline(
+        [(name, stage, workers[name]) for name, stage in ETL_STAGES],
+        logger,
+        PIPELINE_QUEUE_DEPTH
+    )
+
+    # los trabajos se crean conforme la primera etapa tiene lugar en su cola
+    jobs = (new_etl_job(file_info["filename"], deltas_dir, file_info) for file_info in files)
+    errors = pipeline.run(jobs)
+
+    for stage, job, e in errors:
+        job["logger"].error(f"Error: Fallo procesando el archivo: {job['filename']} en la etapa de {stage}: {e}")
+        logger.error(f"Error: Fallo procesando el archivo: {job['filename']} en la etapa de {stage}: {e}")
+        release_failed_file(job["filename"])
+
+    return errors
+
+
 @flow(
     name="Orquestación de ETL de visitas sitio web",
-    task_runner = ConcurrentTaskRunner(max_workers=2)
+    task_runner = ConcurrentTaskRunner(max_workers=FILES_IN_FLIGHT)
 )
 def etl_flow_orchestration():
     """ Esta es la tarea que define el flujo de orquestación del ETL para procesar todos los archivos nuevos """
@@ -21,9 +84,18 @@ def etl_flow_orchestration():
     logger.info("Iniciando ETL de Visitas Web")
     logger.info("=" * 80)
 
-    # 1. Listar archivos nuevos
+    # 0. Aplicar deltas de visitantes de corridas anteriores que no llegaron al final: sus archivos ya se confirmaron
+    # y se borraron del servidor, así que nadie más los volvería a aplicar
+    for pending_dir in list_pending_deltas_dirs(Path(DIR_VISITOR_DELTAS)):
+        logger.warning(f"Advertencia: Se encontraron deltas de visitantes sin aplicar de una corrida anterior en {pending_dir}")
+        apply_visitors_deltas(str(pending_dir), logger)
+
+    # borramos las salidas de transformación en staging que ya no se pueden reutilizar
+    purge_expired_stage_outputs(logger)
+
+    # 1. Listar archivos nuevos (descartando los ya registrados en el manifiesto)
     logger.info("Enlistamos archivos nuevos...")
-    files = list_files()
+    files = list_files(logger)
 
     # valimos que se hayan encontrado archivos
     if not files: 
@@ -31,22 +103,65 @@ def etl_flow_orchestration():
         return []   # no velovemos nada
 
     # logging de cuantos archivos a procesar existen
-    logger.info(f"Se procesarán {len(files)} archivos")
+    logger.info(f"Se procesarán {len(files)} archivos ({sum(file['size'] for file in files)} bytes)")
+    logger.info(f"Límite de conexiones simultáneas a MySQL: {DB_CONCURRENCY_LIMIT}")
+    logger.info("Límites por recurso: " + ", ".join(f"{name}={limiter.limit}" for name, limiter in RESOURCE_LIMITERS.items()))
 
-    # 2. Procesamiento (ETL) paralelo de archivos
-    logger.info("Añadiendo archivos a cola de procesamiento...")
-    subflows_results = []   
-    for filepath in files:
-        run = etl_flow.submit(filepath) # ejecutamos cada el proceso ETL para cada archivo de forma paralela
-        subflows_results.append(run) # guardamos los resultados de las ejecuciones
+    # los archivos más grandes se envían primero para que no alarguen el final de la corrida
+    if SCHEDULE_ORDER == "size":
+        files = sorted(files, key=lambda file_info: file_info["size"], reverse=True)
 
-    # esperamos a que termine de procesarse cada archivo
-    logger.info("Proceso ETL ejecutandose...")
-    results = [r.result() for r in subflows_results]
+    # directorio de deltas de visitantes de esta corrida (modo coalescido)
+    deltas_dir = None
+    if COALESCE_VISITORS:
+        run_id = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        deltas_dir = str(Path(DIR_VISITOR_DELTAS) / run_id)
+        logger.info(f"Modo coalescido: los deltas de visitantes se aplicarán al final desde {deltas_dir}")
+
+    # 2. Procesamiento (ETL) paralelo de archivos
+    if ORCHESTRATION_MODE == "pipeline":
+        logger.info(f"Modo pipeline: etapas traslapadas entre archivos (cola máxima entre etapas: {PIPELINE_QUEUE_DEPTH})")
+        errors = run_pipeline(files, deltas_dir, logger)
+
+        # aplicamos en un solo upsert los deltas de visitantes de todos los archivos cargados (aunque alguno haya fallado)
+        if deltas_dir is not None:
+            logger.info("Aplicando deltas de visitantes de la corrida")
+            apply_visitors_deltas(deltas_dir, logger)
+
+        if errors:
+            raise RuntimeError(f"Fallaron {len(errors)} de {len(files)} archivos en el modo pipeline")
+        results = [True] * len(files)
+
+    else:
+        # agrupamos los archivos pequeños en micro-lotes (un flujo y una transacción por lote)
+        batches = plan_batches(files) if BATCH_SMALL_FILE_BYTES > 0 else [[file_info] for file_info in files]
+        if len(batches) < len(files):
+            logger.info(f"Micro-lotes: {len(files)} archivos agrupados en {len(batches)} ejecuciones")
+
+        logger.info("Añadiendo archivos a cola de procesamiento...")
+        subflows_results = []   
+        for batch in batches:
+            if len(batch) == 1:
+                run = process_file.submit(batch[0], deltas_dir) # ejecutamos cada el proceso ETL para cada archivo de forma paralela
+            else:
+                run = process_batch.submit(batch, deltas_dir)   # los archivos pequeños se procesan por lote
+            subflows_results.append(run) # guardamos los resultados de las ejecuciones
+
+        # esperamos a que termine de procesarse cada archivo
+        logger.info("Proceso ETL ejecutandose...")
+        for r in subflows_results:
+            r.wait()
+
+        # aplicamos en un solo upsert los deltas de visitantes de todos los archivos cargados (aunque alguno haya fallado)
+        if deltas_dir is not None:
+            logger.info("Aplicando deltas de visitantes de la corrida")
+            apply_visitors_deltas(deltas_dir, logger)
+
+        results = [r.result() for r in subflows_results]
 
     # 3. Creación de backup
     logger.info("Creamos el backup de hoy")
-    compress_backup()
+    compress_backup(logger)
 
     # logging de finalización
     logger.info("=" * 80)
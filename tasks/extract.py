@@ -1,14 +1,20 @@
 import logging
-from utils.utils_extract import sftp_connection
-from typing import Optional
+from utils.utils_extract import sftp_connection, download_file, RemoteFileSource
+from utils.utils_flows import EXTRACT_MODE, STREAM_TEE_TO_STAGING, RETRY_DELAY_SECONDS, resource_slot
+from typing import Optional, Union
 from prefect import task
 from pathlib import Path
 
+import posixpath
+import os
+
 
 # Tarea de extracción de datos
-@task(name="Extracción de datos", retries=2, retry_delay_seconds=60)
-def extract(filename: str, logger: logging.Logger) -> Optional[Path]:
-    """ Esta tarea descarga un archivo desde el servidor de inicio a un directorio temporal en el servidor del ETL"""
+@task(name="Extracción de datos", retries=2, retry_delay_seconds=RETRY_DELAY_SECONDS)
+def extract(filename: str, logger: logging.Logger) -> Optional[Union[Path, RemoteFileSource]]:
+    """ Esta tarea descarga un archivo desde el servidor de inicio a un directorio temporal en el servidor del ETL.
+    Si un intento anterior dejó una descarga parcial en staging, se reanuda desde ese punto. En modo "stream" no se
+    descarga nada: se regresa la fuente remota para que la transformación la lea directamente """
     # crear logging de inicio
     logger.info("Iniciando etapa de extración")
 
@@ -17,20 +23,24 @@ def extract(filename: str, logger: logging.Logger) -> Optional[Path]:
     staging_path.mkdir(parents=True, exist_ok=True)
 
     # definir la ruta de origen del archivo
-    remote_path = f"remotedir/{filename}"
+    remote_path = posixpath.join(os.getenv("DIR_SFTP", "."), filename)
 
     # definir la ruta completa de descarga del archivo
-    local_path = f"staging_path/{filename}"
+    local_path = staging_path / filename
+
+    # en modo stream la descarga se traslapa con el parseo dentro de la transformación
+    if EXTRACT_MODE == "stream":
+        logger.info("Modo stream: el archivo se leerá directamente desde el servidor de inicio")
+        with sftp_connection() as sftp:
+            remote_size = sftp.stat(remote_path).st_size
+        return RemoteFileSource(remote_path, local_path if STREAM_TEE_TO_STAGING else None, remote_size)
 
-    # descargar el archivo
+    # descargar el archivo, verificando tamaño y checksum (dentro del límite de transferencias SFTP simultáneas)
     logger.info("Descargando archivo...")
-    with sftp_connection() as sftp:
-        sftp.get(remote_path, local_path)
+    with resource_slot("sftp", logger) as usage, sftp_connection() as sftp:
+        metrics = download_file(sftp, remote_path, local_path, logger)
+        usage["units"] = metrics["bytes"]
         
     # loggear fin de tarea
     logger.info(f"Archivo {filename} descargado a {local_path} con éxito")
     return local_path
-
-
-
-
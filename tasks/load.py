@@ -1,12 +1,25 @@
-from sqlalchemy.pool import QueuePool
-from sqlalchemy import create_engine
 from prefect import task
-from utils.utils_load import (create_mysql_connection_url,
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+from utils.utils_load import (get_mysql_engine,
+                         mysql_transaction,
                          load_statistics_table,
                          load_staging_visitors_table,
+                         reserve_visitors_keys,
                          load_errors_table,
-                         load_log_table
+                         load_log_table,
+                         log_load_throughput,
+                         read_stage_output,
+                         write_visitors_delta,
+                         iter_visitors_deltas,
+                         visitors_deltas_applied,
+                         record_visitors_deltas
 )
+from utils.utils_transform import transform_file_in_chunks, merge_visitors_partials
+from utils.utils_preprocessing import DEDUPLICATE_ROWS, reset_pending_rows
+from utils.utils_flows import RETRY_DELAY_SECONDS, resource_slot
+
+import shutil
 
 import pandas as pd
 import logging
@@ -14,46 +27,211 @@ import logging
 
 
 
-@task(name="cargar datos", retries=2, retry_delay_seconds=60)
-def load(filename: str, stats_df: pd.DataFrame, visitors_df: pd.DataFrame, errors_df: pd.DataFrame, logger: logging.Logger) -> None:
+@task(name="cargar datos", retries=2, retry_delay_seconds=RETRY_DELAY_SECONDS)
+def load(filename: str, stats_df: Union[pd.DataFrame, Path], visitors_df: Union[pd.DataFrame, Path], errors_df: Union[pd.DataFrame, Path],
+         logger: logging.Logger, deltas_dir: Optional[str] = None) -> None:
     """ Esta tarea carga los datos del archivo contenidos a las tablas estadísticas y errores de una base de datos mysql 
-    y después hace el update de la tabla visitantes """
+    y después hace el update de la tabla visitantes. Si se recibe 'deltas_dir', el delta de visitantes se guarda
+    localmente para aplicarse al final de la corrida en lugar de actualizar 'visitantes'. Las tablas pueden llegar
+    como dataframes o como rutas a las salidas Arrow de la transformación """
     # iniciamos el logging de la tarea
     logger.info("Iniciando etapa de carga")
 
-    # establecemos conexión con el servidor mysql
-    mysql_conn_url = create_mysql_connection_url()
-    mysql_engine = create_engine(
-        mysql_conn_url,
-        poolclass=QueuePool,
-        pool_size=100    # 100 conexiones simultaneas permitidas
-        )
+    # leemos las salidas de la transformación (memory map si vienen en archivos Arrow)
+    stats_df = read_stage_output(stats_df)
+    visitors_df = read_stage_output(visitors_df)
+    errors_df = read_stage_output(errors_df)
+
+    # obtenemos el engine compartido del proceso (pool de conexiones reutilizable)
+    mysql_engine = get_mysql_engine()
 
     # cargamos las tablas 
-    with mysql_engine.begin() as conn:
+    delta_tmp_path = None
+    with resource_slot("mysql", logger) as usage, mysql_transaction(mysql_engine, logger) as conn:
         # intentamos cargar las tablas
         try:
+            # cargamos primero la tabla visitantes ('estadisticas' la referencia con una llave foránea). En modo
+            # coalescido sólo se reservan sus emails y el delta se guarda para la corrida
+            if deltas_dir is None:
+                logger.info("Actualizando tabla 'visitantes'")
+                load_staging_visitors_table(visitors_df, conn)
+            elif len(visitors_df) > 0:
+                logger.info("Guardando delta de visitantes para aplicarlo al final de la corrida")
+                reserve_visitors_keys(visitors_df["email"], conn)
+                delta_tmp_path = write_visitors_delta(visitors_df, Path(deltas_dir), filename)
+
             # cargamos tabla de estadísticas
             logger.info("Insertando tabla 'estadisticas'")
-            load_statistics_table(stats_df, conn)
-            
-            # cargamos tabla visitantes temporal (staging)
-            logger.info("Actualizando tabla 'visitantes'")
-            staging_table_name = f"visitantes_{filename}"
-            load_staging_visitors_table(visitors_df, staging_table_name, conn)
+            stats_seconds = load_statistics_table(stats_df, conn)
+            log_load_throughput("estadisticas", len(stats_df), stats_seconds, logger)
             
             # cargamos tabla 'errores'
             if len(errors_df) > 0:
                 logger.info("Insertando tabla 'errores'")
-                load_errors_table(errors_df, conn)
+                errors_seconds = load_errors_table(errors_df, conn)
+                log_load_throughput("errores", len(errors_df), errors_seconds, logger)
 
             # creamos registro de bitacora
-            load_log_table(filename, stats_df, errors_df, conn)
+            load_log_table(filename, len(stats_df), len(errors_df), conn)
+            usage["units"] = len(stats_df) + len(errors_df)
         
         except Exception as e:
             logger.error(f"Error: No se pudo cargar la información a la base de datos. {str(e)}")
             raise e
-            
 
-            
+    # publicamos el delta de visitantes sólo después del commit
+    if delta_tmp_path is not None:
+        delta_tmp_path.rename(delta_tmp_path.with_suffix(""))
+
+
+@task(name="cargar lote de archivos", retries=2, retry_delay_seconds=RETRY_DELAY_SECONDS)
+def load_batch(batch_name: str, record_counts: Dict[str, Tuple[int, int]], stats_df: pd.DataFrame, visitors_df: pd.DataFrame,
+               errors_df: pd.DataFrame, logger: logging.Logger, deltas_dir: Optional[str] = None) -> None:
+    """ Esta tarea carga las tablas combinadas de un micro-lote en una sola transacción (una sola tabla temporal de
+    visitantes para todo el lote) y registra un renglón de 'bitacora' por archivo con sus propios conteos """
+    logger.info(f"Iniciando etapa de carga del lote ({len(record_counts)} archivos)")
+
+    # obtenemos el engine compartido del proceso (pool de conexiones reutilizable)
+    mysql_engine = get_mysql_engine()
+
+    delta_tmp_path = None
+    with resource_slot("mysql", logger) as usage, mysql_transaction(mysql_engine, logger) as conn:
+        try:
+            # cargamos primero la tabla visitantes ('estadisticas' la referencia con una llave foránea). En modo
+            # coalescido sólo se reservan sus emails y el delta del lote se guarda para la corrida
+            if len(visitors_df) > 0 and deltas_dir is None:
+                logger.info("Actualizando tabla 'visitantes'")
+                load_staging_visitors_table(visitors_df, conn)
+            elif len(visitors_df) > 0:
+                logger.info("Guardando delta de visitantes para aplicarlo al final de la corrida")
+                reserve_visitors_keys(visitors_df["email"], conn)
+                delta_tmp_path = write_visitors_delta(visitors_df, Path(deltas_dir), batch_name)
+
+            # cargamos tabla de estadísticas
+            if len(stats_df) > 0:
+                logger.info("Insertando tabla 'estadisticas'")
+                stats_seconds = load_statistics_table(stats_df, conn)
+                log_load_throughput("estadisticas", len(stats_df), stats_seconds, logger)
+
+            # cargamos tabla 'errores' (cada error conserva el nombre de su archivo)
+            if len(errors_df) > 0:
+                logger.info("Insertando tabla 'errores'")
+                errors_seconds = load_errors_table(errors_df, conn)
+                log_load_throughput("errores", len(errors_df), errors_seconds, logger)
+
+            # creamos un registro de bitacora por archivo
+            for filename, (valid_records, invalid_records) in record_counts.items():
+                load_log_table(filename, valid_records, invalid_records, conn)
+            usage["units"] = len(stats_df) + len(errors_df)
+
+        except Exception as e:
+            logger.error(f"Error: No se pudo cargar la información del lote a la base de datos. {str(e)}")
+            raise e
+
+    # publicamos el delta de visitantes sólo después del commit
+    if delta_tmp_path is not None:
+        delta_tmp_path.rename(delta_tmp_path.with_suffix(""))
+
+
+@task(name="transformar y cargar datos por bloques", retries=2, retry_delay_seconds=RETRY_DELAY_SECONDS)
+def load_streaming(filename: str, filepath: Path, logger: logging.Logger, deltas_dir: Optional[str] = None) -> None:
+    """ Esta tarea transforma el archivo por bloques y carga las filas de 'estadisticas' y 'errores' de cada bloque conforme
+    se generan. Los agregados parciales de visitantes se combinan y se aplican al final (o se guardan como delta de la
+    corrida si se recibe 'deltas_dir'), por lo que el uso de memoria no depende del tamaño del archivo """
+    # iniciamos el logging de la tarea
+    logger.info("Iniciando etapa de transformación y carga por bloques")
+
+    # descartamos los hashes de registros que dejó pendientes un intento anterior
+    if DEDUPLICATE_ROWS:
+        reset_pending_rows(filename)
+
+    # obtenemos el engine compartido del proceso (pool de conexiones reutilizable)
+    mysql_engine = get_mysql_engine()
+
+    # todos los bloques se cargan en una misma transacción
+    delta_tmp_path = None
+    with resource_slot("mysql", logger) as usage, mysql_transaction(mysql_engine, logger) as conn:
+        try:
+            visitors_df = None
+            valid_records = 0
+            invalid_records = 0
+            stats_seconds = 0.0
+            errors_seconds = 0.0
+
+            for stats_df, visitors_partial_df, errors_df in transform_file_in_chunks(filepath, filename, logger):
+                # cargamos las filas del bloque; antes reservamos sus emails en 'visitantes' (llave foránea de
+                # 'estadisticas'), el upsert de sus visitas se hace una sola vez al final
+                reserve_visitors_keys(visitors_partial_df["email"], conn)
+                stats_seconds += load_statistics_table(stats_df, conn)
+                if len(errors_df) > 0:
+                    errors_seconds += load_errors_table(errors_df, conn)
+                valid_records += len(stats_df)
+                invalid_records += len(errors_df)
+
+                # combinamos el agregado parcial de visitantes con lo acumulado
+                partials = [visitors_partial_df] if visitors_df is None else [visitors_df, visitors_partial_df]
+                visitors_df = merge_visitors_partials(partials)
+
+            # actualizamos la tabla visitantes con el agregado final, o guardamos el delta para la corrida
+            if visitors_df is not None and deltas_dir is None:
+                logger.info("Actualizando tabla 'visitantes'")
+                load_staging_visitors_table(visitors_df, conn)
+            elif visitors_df is not None and len(visitors_df) > 0:
+                logger.info("Guardando delta de visitantes para aplicarlo al final de la corrida")
+                delta_tmp_path = write_visitors_delta(visitors_df, Path(deltas_dir), filename)
+
+            # creamos registro de bitacora
+            log_load_throughput("estadisticas", valid_records, stats_seconds, logger)
+            log_load_throughput("errores", invalid_records, errors_seconds, logger)
+            load_log_table(filename, valid_records, invalid_records, conn)
+            usage["units"] = valid_records + invalid_records
+
+        except Exception as e:
+            logger.error(f"Error: No se pudo cargar la información a la base de datos. {str(e)}")
+            raise e
+
+    # publicamos el delta de visitantes sólo después del commit
+    if delta_tmp_path is not None:
+        delta_tmp_path.rename(delta_tmp_path.with_suffix(""))
+
+
+@task(name="aplicar deltas de visitantes", retries=2, retry_delay_seconds=RETRY_DELAY_SECONDS)
+def apply_visitors_deltas(deltas_dir: str, logger: logging.Logger) -> None:
+    """ Esta tarea combina los deltas de visitantes de todos los archivos de la corrida y los aplica a la tabla
+    visitantes en un solo upsert, así cada email se bloquea y reescribe una sola vez por corrida """
+    logger.info("Combinando deltas de visitantes de la corrida")
+    deltas_path = Path(deltas_dir)
+
+    # combinamos los deltas uno a uno para no tenerlos todos en memoria a la vez
+    visitors_df = None
+    deltas_count = 0
+    for delta_df in iter_visitors_deltas(deltas_path):
+        partials = [delta_df] if visitors_df is None else [visitors_df, delta_df]
+        visitors_df = merge_visitors_partials(partials)
+        deltas_count += 1
+
+    # validamos que haya deltas que aplicar (los '.tmp' que queden son de cargas que no hicieron commit)
+    if visitors_df is None:
+        logger.warning("Alerta: No hay deltas de visitantes para aplicar")
+        shutil.rmtree(deltas_path, ignore_errors=True)
+        return
+
+    # aplicamos el upsert combinado en una sola transacción, junto con su registro en 'bitacora'; si el directorio
+    # sobrevive al commit (caída o error al borrarlo), la siguiente corrida ve el registro y sólo lo borra
+    mysql_engine = get_mysql_engine()
+    with resource_slot("mysql", logger) as usage, mysql_transaction(mysql_engine, logger) as conn:
+        try:
+            if visitors_deltas_applied(deltas_path, conn):
+                logger.warning(f"Advertencia: Los deltas de visitantes de {deltas_path} ya se habían aplicado")
+            else:
+                logger.info(f"Actualizando tabla 'visitantes' con {len(visitors_df)} emails de {deltas_count} archivos")
+                load_staging_visitors_table(visitors_df, conn)
+                record_visitors_deltas(deltas_path, len(visitors_df), conn)
+                usage["units"] = len(visitors_df)
+
+        except Exception as e:
+            logger.error(f"Error: No se pudo actualizar la tabla 'visitantes'. {str(e)}")
+            raise e
 
+    # limpiamos los deltas ya aplicados
+    shutil.rmtree(deltas_path)
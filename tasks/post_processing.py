@@ -1,29 +1,57 @@
-from utils.utils_postprocessing import move_to_backup, remove_from_sftp, zip_compress
+from utils.utils_postprocessing import move_to_backup, remove_from_sftp, remove_stage_outputs, zip_compress
+from utils.utils_preprocessing import DEDUPLICATE_ROWS, record_processed_file, confirm_rows
+from utils.utils_extract import file_sha256
+from utils.utils_flows import TRANSFORM_EXECUTOR, RETRY_DELAY_SECONDS, run_in_process_pool
 from prefect import task
+from typing import Any, Dict, Optional
+from pathlib import Path
 
 import logging
 
 
-@task(name="post-procesamiento", retries=2, retry_delay_seconds=60)
-def post_processing(filepath: str, logger: logging.Logger)  -> None:
-    """ Tarea para el post procesamiento, generando el backup y borrando los archivos originales """
+@task(name="post-procesamiento", retries=2, retry_delay_seconds=RETRY_DELAY_SECONDS)
+def post_processing(filename: str, filepath: Optional[Path], logger: logging.Logger, file_info: Optional[Dict[str, Any]] = None)  -> None:
+    """ Tarea para el post procesamiento, generando el backup, borrando los archivos originales y registrando el
+    archivo en el manifiesto de procesados """
     # Logging de inicio 
     logger.info("Iniciando etapa de post procesamiento")
 
-    # movemos archivo descargado a backup
-    logger.info("Moviendo el archivo al backup")
-    move_to_backup(filepath)
+    # calculamos el hash del contenido antes de mover el archivo (en un reintento ya movido, usamos el del servidor)
+    sha256 = file_sha256(filepath) if filepath is not None and filepath.exists() else (file_info or {}).get("sha256")
+
+    # movemos archivo descargado a backup (en modo stream sin copia en staging no hay archivo local)
+    if filepath is not None and filepath.exists():
+        logger.info("Moviendo el archivo al backup")
+        move_to_backup(filepath)
+    else:
+        logger.warning("Advertencia: No hay copia local del archivo para el backup")
+
+    # borramos las salidas de transformación en staging (sólo existen con STAGE_HANDOFF="arrow")
+    remove_stage_outputs(filename)
+
+    # registramos el archivo en el manifiesto para no volver a procesarlo
+    if file_info is not None:
+        logger.info("Registrando archivo en el manifiesto de procesados")
+        record_processed_file(filename, file_info["size"], file_info["mtime"], sha256)
+
+    # confirmamos los hashes de los registros cargados para detectar duplicados en archivos futuros
+    if DEDUPLICATE_ROWS:
+        confirm_rows(filename)
 
     # removemos el archivo original
     logger.info("Removimiento archivo del servidor de inicio")
-    remove_from_sftp()
+    remove_from_sftp(filename)
 
 
-@task(name="comprimir backup", retries=2, retry_delay_seconds=60)
-def compress_backup():
-    """ Tarea para comprimir todos los archivos procesados y guardarlos como backup """    
+@task(name="comprimir backup", retries=2, retry_delay_seconds=RETRY_DELAY_SECONDS)
+def compress_backup(logger: Optional[logging.Logger] = None):
+    """ Tarea para comprimir todos los archivos procesados y guardarlos como backup. Con TRANSFORM_EXECUTOR="process"
+    la compresión corre en el pool de procesos """    
     # comprimimos mediante zip
-    zip_compress()
+    if TRANSFORM_EXECUTOR == "process":
+        run_in_process_pool(zip_compress, logger=logger or logging.getLogger(__name__))
+    else:
+        zip_compress()
 
 
 
@@ -1,25 +1,69 @@
-from utils.utils import sftp_connection
+from utils.utils_extract import sftp_connection, read_remote_checksum
+from utils.utils_flows import RETRY_DELAY_SECONDS
+from utils.utils_preprocessing import (
+    DEDUPLICATE_FILES,
+    DEDUPLICATE_ROWS,
+    filter_new_files,
+    find_duplicate_file,
+    purge_expired_rows
+)
+from tasks.post_processing import post_processing
 from prefect import task
-from typing import List
+from typing import Any, Dict, List, Optional
 
+import posixpath
+import logging
 import os
 
 
-@task(name="Enlistar archivos nuevos", retries=2, retry_delay_seconds=60)
-def list_files() -> List[str]:
-    """ Función que enlista la cantidad de archivos a procesar """
+@task(name="Enlistar archivos nuevos", retries=2, retry_delay_seconds=RETRY_DELAY_SECONDS)
+def list_files(logger: Optional[logging.Logger] = None) -> List[Dict[str, Any]]:
+    """ Función que enlista los archivos nuevos o modificados a procesar, con su tamaño y fecha de modificación. Si el
+    servidor publica el sha256 de los archivos, los que repiten el contenido de uno ya procesado (re-entregas con otro
+    nombre) se descartan antes de descargarlos: pasan directo al post procesamiento, que los registra en el manifiesto
+    y los borra del servidor (su contenido ya está en el backup del archivo original) """
+    logger = logger or logging.getLogger(__name__)
+    sftp_dir = os.getenv("DIR_SFTP", ".")
+
+    # depuramos el índice de hashes de registros según la retención
+    if DEDUPLICATE_ROWS:
+        purged = purge_expired_rows()
+        if purged:
+            logger.info(f"Se depuraron {purged} hashes de registros fuera de la retención")
+
     # conectamos con servidor 
     with sftp_connection() as sftp:
-        # buscamos el directorio de datos
-        sftp.chdir(os.getenv("DIR_SFTP"))
-
-        # enlistamos archivos
+        # enlistamos archivos con sus metadatos en una sola llamada
         files = [
-            file for file in sftp.listdir()
-            if file.startswith("report_") and file.endswith(".txt")
+            {"filename": attr.filename, "size": attr.st_size, "mtime": attr.st_mtime}
+            for attr in sftp.listdir_attr(sftp_dir)
+            if attr.filename.startswith("report_") and attr.filename.endswith(".txt")
         ]
-    return files
 
+        # descartamos los archivos ya procesados según el manifiesto local
+        files = filter_new_files(files)
+        if not DEDUPLICATE_FILES:
+            return files
+
+        # descartamos los archivos con el mismo contenido que uno ya procesado o que otro de este mismo listado
+        new_files = []
+        duplicate_files = []
+        listed_sha256 = {}
+        for file_info in files:
+            file_info["sha256"] = read_remote_checksum(sftp, posixpath.join(sftp_dir, file_info["filename"]))
+            duplicate_of = find_duplicate_file(file_info["sha256"]) or listed_sha256.get(file_info["sha256"])
+            if duplicate_of is not None:
+                logger.warning(f"Advertencia: {file_info['filename']} es una re-entrega de {duplicate_of}, se omite")
+                duplicate_files.append(file_info)
+                continue
+
+            if file_info["sha256"] is not None:
+                listed_sha256[file_info["sha256"]] = file_info["filename"]
+            new_files.append(file_info)
 
+    # las re-entregas no se descargan: se registran en el manifiesto y se borran del servidor para que no se
+    # acumulen en el directorio remoto
+    for file_info in duplicate_files:
+        post_processing(file_info["filename"], None, logger, file_info)
 
-    
\ No newline at end of file
+    return new_files
@@ -1,49 +1,121 @@
-from typing import Tuple, Optional
+from typing import Dict, List, Tuple, Optional, Union
 from pathlib import Path
 from prefect import task
+from utils.utils_flows import (
+    STAGE_HANDOFF,
+    TRANSFORM_EXECUTOR,
+    SHARD_THRESHOLD_BYTES,
+    RETRY_DELAY_SECONDS,
+    run_in_process_pool,
+    resource_slot
+)
+from utils.utils_preprocessing import DEDUPLICATE_ROWS, reset_pending_rows
 from utils.utils_transform import (
-    validate_file_loading, 
-    validate_file_layout, 
-    validate_data_quality,
-    prepare_data
+    PYARROW_AVAILABLE,
+    transform_cache_key,
+    transform_file,
+    transform_file_sharded,
+    combine_file_tables,
+    transform_file_to_stage,
+    write_stage_outputs,
+    find_stage_outputs
 )
 
 import logging
 import pandas as pd
 
-        
-@task(name="transformar datos", retries=2, retry_delay_seconds=60)
-def transform(filepath: Path, logger: logging.Logger) -> Tuple[pd.DataFrame, pd.DataFrame, Optional[pd.DataFrame]]:
-    """ Esta tarea valida la calidad de los datos para después hacer las transformaciones necesarias previo a la carga."""
+
+@task(name="transformar datos", retries=2, retry_delay_seconds=RETRY_DELAY_SECONDS)
+def transform(filepath: Path, logger: logging.Logger) -> Tuple[Union[pd.DataFrame, Path], ...]:
+    """ Esta tarea valida la calidad de los datos para después hacer las transformaciones necesarias previo a la carga.
+    Con STAGE_HANDOFF="arrow" las tablas se guardan como archivos Arrow IPC en staging y se regresan sus rutas; si
+    un intento anterior del flujo ya las dejó listas (mismo archivo, configuración y código), se reutilizan sin volver
+    a transformar el archivo. Los hashes de registros que reclamó ese intento siguen pendientes para el archivo. Con
+    STAGE_HANDOFF="memory" las tablas no sobreviven al intento y un reintento del flujo vuelve a transformar. Con
+    TRANSFORM_EXECUTOR="process" el trabajo de CPU corre en un proceso worker y sólo viajan rutas entre procesos. Los
+    archivos de al menos SHARD_THRESHOLD_BYTES se transforman por fragmentos en paralelo """
     # inicializar el logger
     logger.info("Iniciando etapa de transformación")
 
     # extraemos el nombre del archivo 
     filename = filepath.name
 
-    # intentamos abrimos el archivo 
-    logger.info(f"Abriendo el archivo {filename}...")
-    file_df = validate_file_loading(filepath, logger)
+    # validamos que se pueda usar la entrega en archivos Arrow
+    use_arrow = STAGE_HANDOFF == "arrow"
+    if use_arrow and not PYARROW_AVAILABLE:
+        logger.warning("Advertencia: pyarrow no está instalado, las tablas se entregan en memoria")
+        use_arrow = False
+
+    # reutilizamos las salidas de un intento anterior con el mismo contenido y versión del código
+    if use_arrow:
+        cache_key = transform_cache_key(filepath)
+        stage_outputs = find_stage_outputs(filename, cache_key)
+        if stage_outputs is not None:
+            logger.info(f"Reutilizando las salidas de transformación guardadas en {stage_outputs[0].parent}")
+            return stage_outputs
+
+    # descartamos los hashes de registros que dejó pendientes un intento anterior
+    if DEDUPLICATE_ROWS:
+        reset_pending_rows(filename)
+
+    # ocupamos un lugar de CPU mientras se transforma el archivo (el throughput se mide en bytes del archivo)
+    with resource_slot("cpu", logger) as usage:
+        usage["units"] = filepath.stat().st_size if isinstance(filepath, Path) else (filepath.size or 0)
+
+        # los archivos grandes se parten en fragmentos que se transforman en paralelo y se juntan para una sola carga
+        if SHARD_THRESHOLD_BYTES > 0 and isinstance(filepath, Path) and usage["units"] >= SHARD_THRESHOLD_BYTES:
+            tables = transform_file_sharded(filepath, logger)
+
+        # transformamos en un proceso worker: lee el archivo y deja sus tablas en staging
+        elif TRANSFORM_EXECUTOR == "process" and use_arrow:
+            logger.info("Transformando el archivo en el pool de procesos")
+            return run_in_process_pool(transform_file_to_stage, filepath, cache_key, logger=logger)
+
+        # transformamos en el hilo de la tarea
+        else:
+            tables = transform_file(filepath, logger)
+
+        # guardamos las tablas en staging para que la carga las lea sin pasar por los resultados de la tarea
+        if tables is not None and use_arrow:
+            logger.info("Guardando tablas de salida en formato Arrow")
+            return write_stage_outputs(filename, cache_key, *tables)
+
+    return tables
+
+
+@task(name="transformar lote de archivos", retries=2, retry_delay_seconds=RETRY_DELAY_SECONDS)
+def transform_batch(filepaths: List[Path], logger: logging.Logger) -> Tuple[Optional[Tuple[pd.DataFrame, ...]], Dict[str, Tuple[int, int]], List[str]]:
+    """ Esta tarea transforma los archivos de un micro-lote y junta sus tablas para cargarlas en una sola transacción.
+    Regresa las tablas combinadas (None si ningún archivo se pudo transformar), los registros válidos e inválidos por
+    archivo y los nombres de los archivos que fallaron, que no detienen al resto del lote """
+    logger.info(f"Iniciando etapa de transformación del lote ({len(filepaths)} archivos)")
+
+    tables_by_file = {}
+    failed_files = []
+    with resource_slot("cpu", logger) as usage:
+        for filepath in filepaths:
+            filename = filepath.name
 
-    # comprobamos que el archivo no esté vacío
-    if not file_df.empty():
-        # validamos el layout del archivo
-        logger.info("Validando el layout del archivo...")
-        valid_layout = validate_file_layout(file_df, logger)
-        
-        # si el layout es válido, continuamos
-        if valid_layout:
-            # validamos la calidad de los datos
-            logger.info("Validando la calidad de los datos...")
-            file_ok_df, file_err_df = validate_data_quality(file_df, logger)
+            # descartamos los hashes de registros que dejó pendientes un intento anterior
+            if DEDUPLICATE_ROWS:
+                reset_pending_rows(filename)
 
-            # preparamos los datos para la carga
-            logger.info("Preparando datos para la carga...")
-            stats_df, visitors_df, errors_df = prepare_data(filename, file_ok_df, file_err_df, logger)
-            return stats_df, visitors_df, errors_df
-    
-    logger.warning("Alerta: Este archivo está vacío")
+            # un archivo inválido se reporta sin detener la transformación del resto del lote
+            try:
+                tables = transform_file(filepath, logger)
+            except Exception as e:
+                logger.error(f"Error: No se pudo transformar el archivo {filename}. {str(e)}")
+                tables = None
 
+            if tables is None:
+                failed_files.append(filename)
+            else:
+                tables_by_file[filename] = tables
 
+        usage["units"] = sum(filepath.stat().st_size for filepath in filepaths if isinstance(filepath, Path))
 
+    if not tables_by_file:
+        return None, {}, failed_files
 
+    tables, record_counts = combine_file_tables(tables_by_file)
+    return tables, record_counts, failed_files
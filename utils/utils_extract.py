@@ -1,33 +1,311 @@
 from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+from pathlib import Path
 import paramiko
+import threading
+import posixpath
+import hashlib
+import logging
+import time
+import io
 import os
 
 
+# Configuración del pool de sesiones SFTP por worker
+SFTP_MAX_SESSIONS = int(os.getenv("SFTP_MAX_SESSIONS", 4))             # sesiones simultáneas máximas por proceso
+SFTP_KEEPALIVE_SECONDS = int(os.getenv("SFTP_KEEPALIVE", 30))          # keepalive del transporte ssh
+SFTP_HEALTHCHECK_IDLE = int(os.getenv("SFTP_HEALTHCHECK_IDLE", 30))    # segundos inactiva antes de verificar la sesión
+SFTP_ACQUIRE_TIMEOUT = int(os.getenv("SFTP_ACQUIRE_TIMEOUT", 300))     # espera máxima por una sesión libre
 
-@contextmanager
-def sftp_connection():
-    """ Set  up de la conexión con el servidor de inicio mediante SFTP """
-    # inicializamos los recursos de conexión como None
-    transport = None
-    sftp = None
+# Configuración del motor de descarga
+SFTP_PIPELINE_THRESHOLD = int(os.getenv("SFTP_PIPELINE_THRESHOLD", 8 * 1024 * 1024))   # bytes a partir de los que se usan lecturas concurrentes
+SFTP_MAX_REQUESTS = int(os.getenv("SFTP_MAX_REQUESTS", 64))            # lecturas concurrentes en vuelo por archivo
+SFTP_WINDOW_SIZE = 64 * 1024 * 1024     # bytes solicitados por ventana (acota la memoria del prefetch)
+SFTP_BLOCK_SIZE = 1024 * 1024           # bytes escritos a disco por iteración
+SFTP_PREFETCH_READ_SIZE = 32 * 1024     # tamaño de cada petición del prefetch de paramiko
+CHECKSUM_SUFFIX = ".sha256"             # archivo hermano opcional en el servidor con el sha256 del reporte
 
-    # intentar conexión a servidor sftp
-    try:
+# Errores que indican que la sesión quedó inservible y no debe regresar al pool
+SFTP_CONNECTION_ERRORS = (paramiko.SSHException, EOFError, TimeoutError, ConnectionError)
+
+
+class SFTPSessionPool:
+    """ Pool de sesiones SFTP reutilizables (transporte + cliente) con keepalive, verificación de salud y reconexión """
+
+    def __init__(self, max_sessions: int = SFTP_MAX_SESSIONS, keepalive_seconds: int = SFTP_KEEPALIVE_SECONDS):
+        self.keepalive_seconds = keepalive_seconds
+        self._idle: List[Tuple[paramiko.Transport, paramiko.SFTPClient, float]] = []   # (transporte, cliente, último uso)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_sessions)
+
+    def _connect(self) -> Tuple[paramiko.Transport, paramiko.SFTPClient]:
+        """ Establece una sesión nueva con el servidor de inicio """
         # se definen las credenciales de conexión
         port = int(os.getenv("PORT_SFTP"))
         host = os.getenv("HOST_SFTP")
         # establece la conexion mediante sftp
         transport = paramiko.Transport((host, port))
-        transport.connect(username=os.getenv("USER_SFTP"), password=os.getenv("PASSWORD_SFTP"))
-        sftp = paramiko.SFTPClient.from_transport(transport)
-        # cedemos control al with
+        try:
+            transport.set_keepalive(self.keepalive_seconds)
+            transport.connect(username=os.getenv("USER_SFTP"), password=os.getenv("PASSWORD_SFTP"))
+            sftp = paramiko.SFTPClient.from_transport(transport)
+        except Exception:
+            transport.close()
+            raise
+        return transport, sftp
+
+    @staticmethod
+    def _close(transport: paramiko.Transport, sftp: paramiko.SFTPClient) -> None:
+        """ Cierra una sesión ignorando errores (la sesión puede estar ya caída) """
+        try:
+            sftp.close()
+        except Exception:
+            pass
+        transport.close()
+
+    @staticmethod
+    def _is_healthy(transport: paramiko.Transport, sftp: paramiko.SFTPClient, last_used: float) -> bool:
+        """ Verifica que una sesión inactiva siga viva antes de reutilizarla """
+        if not transport.is_active():
+            return False
+        # sólo hacemos el round-trip si la sesión lleva tiempo inactiva
+        if time.monotonic() - last_used < SFTP_HEALTHCHECK_IDLE:
+            return True
+        try:
+            sftp.stat(".")
+            return True
+        except Exception:
+            return False
+
+    def acquire(self) -> Tuple[paramiko.Transport, paramiko.SFTPClient]:
+        """ Obtiene una sesión sana del pool o abre una nueva si no hay disponibles """
+        if not self._slots.acquire(timeout=SFTP_ACQUIRE_TIMEOUT):
+            raise TimeoutError("No hay sesiones SFTP disponibles en el pool")
+
+        try:
+            # reutilizamos la sesión inactiva más reciente que siga sana
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    transport, sftp, last_used = self._idle.pop()
+                if self._is_healthy(transport, sftp, last_used):
+                    return transport, sftp
+                self._close(transport, sftp)    # sesión caída: la descartamos y probamos la siguiente
+
+            # no hay sesiones reutilizables: reconectamos
+            return self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, transport: paramiko.Transport, sftp: paramiko.SFTPClient, broken: bool = False) -> None:
+        """ Regresa una sesión al pool, o la cierra si quedó inservible. Nunca lanza excepciones, para no ocultar el
+        error original de una transferencia fallida """
+        try:
+            if not broken and transport.is_active():
+                try:
+                    sftp.chdir(None)    # limpiamos el directorio de trabajo para el siguiente usuario
+                except Exception:
+                    broken = True       # el canal quedó inservible: descartamos la sesión
+
+            if broken or not transport.is_active():
+                self._close(transport, sftp)
+            else:
+                with self._lock:
+                    self._idle.append((transport, sftp, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def close_all(self) -> None:
+        """ Cierra todas las sesiones inactivas del pool """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for transport, sftp, _ in idle:
+            self._close(transport, sftp)
+
+
+# Pool de sesiones por proceso (un proceso hijo nunca reutiliza los sockets del padre)
+_SFTP_POOLS: Dict[int, SFTPSessionPool] = {}
+_SFTP_POOLS_LOCK = threading.Lock()
+
+
+def get_sftp_pool() -> SFTPSessionPool:
+    """ Regresa el pool de sesiones SFTP del proceso actual, creándolo la primera vez """
+    with _SFTP_POOLS_LOCK:
+        pool = _SFTP_POOLS.get(os.getpid())
+        if pool is None:
+            pool = SFTPSessionPool()
+            _SFTP_POOLS[os.getpid()] = pool
+    return pool
+
+
+@contextmanager
+def sftp_connection(pool: Optional[SFTPSessionPool] = None):
+    """ Set  up de la conexión con el servidor de inicio mediante SFTP, tomando una sesión del pool del worker """
+    pool = pool or get_sftp_pool()
+    transport, sftp = pool.acquire()
+    broken = False
+
+    # cedemos control al with
+    try:
         yield sftp
 
+    except SFTP_CONNECTION_ERRORS:
+        # la sesión pudo quedar inservible, no la regresamos al pool
+        broken = True
+        raise
+
     finally:
-        # cerramos la conexión si está fue establecida
-        if sftp is not None:
-            sftp.close()
-        if transport is not None:
-            transport.close()
-            
+        pool.release(transport, sftp, broken)
+
+
+def file_sha256(filepath: Path) -> str:
+    """ Calcula el sha256 de un archivo local leyéndolo por bloques """
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(SFTP_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_remote_checksum(sftp: paramiko.SFTPClient, remote_path: str) -> Optional[str]:
+    """ Obtiene el sha256 esperado de un archivo remoto: primero del archivo hermano '.sha256' y, si no existe,
+    de la extensión 'check-file' del servidor. Regresa None si el servidor no ofrece ninguno de los dos """
+    # archivo hermano publicado junto al reporte
+    try:
+        with sftp.open(remote_path + CHECKSUM_SUFFIX, "r") as f:
+            return f.read().decode().split()[0].lower()
+    except (IOError, IndexError):
+        pass
+
+    # hash calculado por el servidor (no todos los servidores lo soportan)
+    try:
+        with sftp.open(remote_path, "r") as f:
+            return f.check("sha256").hex()
+    except IOError:
+        return None
+
+
+def _download_range(remote_file: paramiko.SFTPFile, local_file, offset: int, remote_size: int) -> None:
+    """ Descarga los bytes [offset, remote_size) emitiendo lecturas concurrentes por ventanas acotadas """
+    for window_start in range(offset, remote_size, SFTP_WINDOW_SIZE):
+        window_end = min(window_start + SFTP_WINDOW_SIZE, remote_size)
+        chunks = [
+            (chunk_start, min(SFTP_BLOCK_SIZE, window_end - chunk_start))
+            for chunk_start in range(window_start, window_end, SFTP_BLOCK_SIZE)
+        ]
+        for data in remote_file.readv(chunks, max_concurrent_prefetch_requests=SFTP_MAX_REQUESTS):
+            local_file.write(data)
+
+
+def download_file(sftp: paramiko.SFTPClient, remote_path: str, local_path: Path, logger: logging.Logger) -> Dict[str, Any]:
+    """ Descarga un archivo remoto reanudando desde los bytes ya presentes en staging, con lecturas concurrentes para
+    archivos grandes, y verifica tamaño y checksum antes de entregarlo. Regresa las métricas de la descarga """
+    remote_size = sftp.stat(remote_path).st_size
+
+    # reanudamos desde lo ya descargado; si el archivo local es mayor al remoto, está corrupto y se descarta
+    offset = local_path.stat().st_size if local_path.exists() else 0
+    if offset > remote_size:
+        logger.warning(f"Advertencia: El archivo local es mayor al remoto ({offset} > {remote_size}), se descarga de nuevo")
+        offset = 0
+    if offset > 0:
+        logger.info(f"Reanudando descarga desde el byte {offset} de {remote_size}")
+
+    # descargamos los bytes faltantes
+    start = time.perf_counter()
+    with sftp.open(remote_path, "rb") as remote_file, open(local_path, "r+b" if offset > 0 else "wb") as local_file:
+        local_file.seek(offset)
+        local_file.truncate()
+        if remote_size - offset >= SFTP_PIPELINE_THRESHOLD:
+            _download_range(remote_file, local_file, offset, remote_size)
+        else:
+            # se escribe cada petición del prefetch conforme llega, para que un corte a la mitad deje en staging
+            # los bytes ya recibidos y el reintento reanude desde ahí
+            remote_file.seek(offset)
+            remote_file.prefetch(remote_size)
+            for block in iter(lambda: remote_file.read(SFTP_PREFETCH_READ_SIZE), b""):
+                local_file.write(block)
+    elapsed = time.perf_counter() - start
+    downloaded_bytes = remote_size - offset
+
+    # verificamos el tamaño
+    local_size = local_path.stat().st_size
+    if local_size != remote_size:
+        raise IOError(f"Descarga incompleta de {remote_path}: {local_size} de {remote_size} bytes")
+
+    # verificamos el checksum; si no coincide borramos el archivo para que el reintento descargue desde cero
+    sha256 = file_sha256(local_path)
+    expected_sha256 = read_remote_checksum(sftp, remote_path)
+    if expected_sha256 is None:
+        logger.info(f"El servidor no publica checksum, sólo se verificó el tamaño (sha256 local: {sha256})")
+    elif expected_sha256 != sha256:
+        local_path.unlink()
+        raise IOError(f"Checksum inválido para {remote_path}: esperado {expected_sha256}, obtenido {sha256}")
+
+    # registramos el throughput de la descarga
+    throughput = downloaded_bytes / elapsed if elapsed > 0 else 0.0
+    logger.info(f"Descargados {downloaded_bytes} bytes en {elapsed:.2f}s ({throughput / 1024 / 1024:.2f} MB/s)")
+
+    return {"bytes": downloaded_bytes, "seconds": elapsed, "bytes_per_second": throughput, "sha256": sha256}
+
+
+class TeeReader(io.RawIOBase):
+    """ Lector de un archivo remoto que opcionalmente escribe una copia local de los bytes conforme se leen """
+
+    def __init__(self, remote_file: paramiko.SFTPFile, tee_path: Optional[Path] = None):
+        self.remote_file = remote_file
+        self.tee_path = tee_path
+        self._tee_tmp_path = tee_path.with_name(tee_path.name + ".part") if tee_path is not None else None
+        self._tee_file = open(self._tee_tmp_path, "wb") if tee_path is not None else None
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.remote_file.read(len(buffer))
+        if not data:
+            self._eof = True
+            return 0
+        if self._tee_file is not None:
+            self._tee_file.write(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self) -> None:
+        # la copia local sólo se publica si el archivo se leyó completo
+        if self._tee_file is not None and not self._tee_file.closed:
+            self._tee_file.close()
+            if self._eof:
+                self._tee_tmp_path.replace(self.tee_path)
+            else:
+                self._tee_tmp_path.unlink(missing_ok=True)
+        super().close()
+
+
+class RemoteFileSource:
+    """ Referencia ligera a un archivo del servidor de inicio que la transformación lee directamente como stream,
+    traslapando la descarga con el parseo. Opcionalmente deja una copia en staging ('tee_path') para el backup.
+    'size' es el tamaño del archivo en el servidor, con el que se mide el trabajo de la transformación """
+
+    def __init__(self, remote_path: str, tee_path: Optional[Path] = None, size: Optional[int] = None):
+        self.remote_path = remote_path
+        self.tee_path = tee_path
+        self.size = size
+
+    @property
+    def name(self) -> str:
+        return posixpath.basename(self.remote_path)
 
+    @contextmanager
+    def open_stream(self, buffer_size: int = SFTP_BLOCK_SIZE):
+        """ Abre el archivo remoto como un stream con buffer y lecturas anticipadas (prefetch) en segundo plano """
+        with sftp_connection() as sftp:
+            with sftp.open(self.remote_path, "rb") as remote_file:
+                remote_file.prefetch(max_concurrent_requests=SFTP_MAX_REQUESTS)
+                stream = io.BufferedReader(TeeReader(remote_file, self.tee_path), buffer_size=buffer_size)
+                try:
+                    yield stream
+                finally:
+                    stream.close()
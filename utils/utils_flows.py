@@ -1,23 +1,384 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from pathlib import Path
+
+import multiprocessing
+import contextvars
+import threading
+import queue
 import datetime
+import hashlib
 import logging
+import math
+import time
 import os
 
 
+# Modo de transformación del flujo ETL: "batch" (archivo completo en memoria) o "streaming" (por bloques)
+TRANSFORM_MODE = os.getenv("TRANSFORM_MODE", "batch")
+
+# Modo de extracción: "download" (descarga completa a staging) o "stream" (la transformación lee directo del SFTP)
+EXTRACT_MODE = os.getenv("EXTRACT_MODE", "download")
+STREAM_TEE_TO_STAGING = os.getenv("STREAM_TEE_TO_STAGING", "true").lower() == "true"   # copia en staging para el backup
+
+# Espera (segundos) entre reintentos de las tareas y de los flujos
+RETRY_DELAY_SECONDS = int(os.getenv("RETRY_DELAY_SECONDS", 60))
+
+# Límite de conexiones simultáneas a MySQL para todo el proceso (dimensiona el pool de conexiones)
+DB_CONCURRENCY_LIMIT = int(os.getenv("DB_CONCURRENCY_LIMIT", 8))
+
+# Coalescer los deltas de visitantes de todos los archivos de la corrida en un solo upsert al final
+COALESCE_VISITORS = os.getenv("COALESCE_VISITORS", "false").lower() == "true"
+DIR_VISITOR_DELTAS = os.getenv("DIR_VISITOR_DELTAS", "visitor_deltas")   # directorio local de deltas por corrida
+
+# Entrega de datos de transformación a carga: "memory" (dataframes como resultado de la tarea) o "arrow" (archivos
+# Arrow IPC en staging que la carga lee con memory map; requiere la dependencia opcional pyarrow)
+STAGE_HANDOFF = os.getenv("STAGE_HANDOFF", "memory")
+
+# Ejecución de la transformación: "thread" (en el hilo de la tarea) o "process" (pool de procesos, fuera del GIL)
+TRANSFORM_EXECUTOR = os.getenv("TRANSFORM_EXECUTOR", "thread")
+PROCESS_POOL_WORKERS = int(os.getenv("PROCESS_POOL_WORKERS", os.cpu_count() or 1))   # por defecto, un proceso por núcleo
+if TRANSFORM_EXECUTOR == "process":
+    STAGE_HANDOFF = "arrow"     # los procesos worker entregan sus tablas en archivos, nunca como dataframes serializados
+
+# Fragmentación de archivos grandes: los archivos locales de al menos SHARD_THRESHOLD_BYTES se parten por rangos de
+# bytes (en límites de línea) en SHARD_COUNT fragmentos que se transforman en paralelo. 0 desactiva la fragmentación
+SHARD_THRESHOLD_BYTES = int(os.getenv("SHARD_THRESHOLD_BYTES", 0))
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", PROCESS_POOL_WORKERS))
+
+# Orquestación: "per_file" (un flujo ETL completo por archivo) o "pipeline" (etapas traslapadas entre archivos, con
+# colas acotadas entre etapas)
+ORCHESTRATION_MODE = os.getenv("ORCHESTRATION_MODE", "per_file")
+PIPELINE_QUEUE_DEPTH = int(os.getenv("PIPELINE_QUEUE_DEPTH", 2))     # archivos en espera máximos entre dos etapas
+
+# Micro-lotes: los archivos de hasta BATCH_SMALL_FILE_BYTES se agrupan en lotes (hasta BATCH_MAX_BYTES y BATCH_MAX_FILES)
+# que se transforman juntos y se cargan en una sola transacción. 0 desactiva los lotes
+BATCH_SMALL_FILE_BYTES = int(os.getenv("BATCH_SMALL_FILE_BYTES", 0))
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", 64 * 1024 ** 2))
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", 200))
+
+# Planificación de archivos: "size" (los más grandes primero) o "listing" (orden del listado)
+SCHEDULE_ORDER = os.getenv("SCHEDULE_ORDER", "size")
+FILES_IN_FLIGHT = int(os.getenv("FILES_IN_FLIGHT", 8))     # archivos en proceso a la vez; cada etapa tiene su propio límite
+
+# Límites de concurrencia por recurso (máximos); con ADAPTIVE_LIMITS se ajustan durante la corrida entre 1 y el máximo
+SFTP_CONCURRENCY_LIMIT = int(os.getenv("SFTP_CONCURRENCY_LIMIT", os.getenv("SFTP_MAX_SESSIONS", 4)))
+CPU_CONCURRENCY_LIMIT = int(os.getenv("CPU_CONCURRENCY_LIMIT", PROCESS_POOL_WORKERS))
+ADAPTIVE_LIMITS = os.getenv("ADAPTIVE_LIMITS", "true").lower() == "true"
+ADAPT_WINDOW = int(os.getenv("ADAPT_WINDOW", 3))                    # etapas completadas entre cada ajuste
+ADAPT_SMOOTHING = float(os.getenv("ADAPT_SMOOTHING", 0.3))          # peso de cada ventana en el nuevo límite (0-1]
+
+# Pool de procesos por proceso padre, indexado por pid
+_PROCESS_POOLS: Dict[int, ProcessPoolExecutor] = {}
+_PROCESS_POOLS_LOCK = threading.Lock()
+
+# Vigencia (horas) de los resultados de etapa en caché, indexados por contenido del archivo y versión del código
+STAGE_CACHE_EXPIRATION_HOURS = float(os.getenv("STAGE_CACHE_EXPIRATION_HOURS", 24))
+
+
+def code_version(*source_files: Path) -> str:
+    """ Calcula la versión del código de una etapa como el hash de sus archivos fuente, así los resultados en caché
+    dejan de usarse en cuanto cambia el código que los generó """
+    digest = hashlib.sha256()
+    for source_file in source_files:
+        digest.update(Path(source_file).read_bytes())
+    return digest.hexdigest()
+
+
+class AdaptiveLimiter:
+    """ Semáforo con límite ajustable para un recurso (SFTP, CPU o MySQL). Cada ventana de ADAPT_WINDOW etapas mide el
+    tiempo por unidad de trabajo (bytes, registros) y lo compara con el mejor observado: si el recurso se satura el
+    tiempo por unidad crece y el límite baja en la misma proporción; el margen sqrt(límite) permite volver a subirlo
+    cuando la saturación desaparece """
+
+    def __init__(self, name: str, max_limit: int, adaptive: bool = ADAPTIVE_LIMITS):
+        self.name = name
+        self.max_limit = max(max_limit, 1)
+        self.limit = self.max_limit
+        self.adaptive = adaptive
+        self._estimate = float(self.max_limit)     # límite estimado sin redondear, suavizado entre ventanas
+        self._active = 0
+        self._condition = threading.Condition()
+        self._best_seconds_per_unit: Optional[float] = None
+        self._window_seconds = 0.0
+        self._window_units = 0.0
+        self._window_count = 0
+
+    @contextmanager
+    def slot(self, logger: logging.Logger) -> Iterator[Dict[str, float]]:
+        """ Ocupa un lugar del recurso mientras dura el bloque. El bloque reporta el trabajo hecho en usage["units"]
+        (en las unidades del recurso: bytes, registros) para normalizar su duración; un bloque que falla o que no
+        reporta trabajo no se mide """
+        start_wait = time.perf_counter()
+        with self._condition:
+            while self._active >= self.limit:
+                self._condition.wait()
+            self._active += 1
+        start = time.perf_counter()
+        if start - start_wait > 1:
+            logger.info(f"Espera de {start - start_wait:.2f}s por el recurso '{self.name}' (límite {self.limit})")
+
+        usage = {"units": 0.0}
+        completed = False
+        try:
+            yield usage
+            completed = True
+        finally:
+            seconds = time.perf_counter() - start
+            with self._condition:
+                self._active -= 1
+                if completed:
+                    self._record(usage["units"], seconds, logger)
+                self._condition.notify_all()
+
+    def _record(self, units: float, seconds: float, logger: logging.Logger) -> None:
+        """ Acumula una etapa completada en la ventana actual y ajusta el límite al cerrarla """
+        # una etapa sin trabajo (ej. descarga ya completa) no dice nada de la saturación del recurso
+        if not self.adaptive or units <= 0:
+            return
+
+        self._window_seconds += seconds
+        self._window_units += units
+        self._window_count += 1
+        if self._window_count < ADAPT_WINDOW:
+            return
+
+        # gradiente: mejor tiempo por unidad observado / tiempo por unidad de esta ventana (1 = sin saturación)
+        seconds_per_unit = self._window_seconds / self._window_units
+        if self._best_seconds_per_unit is None or seconds_per_unit < self._best_seconds_per_unit:
+            self._best_seconds_per_unit = seconds_per_unit
+        gradient = self._best_seconds_per_unit / seconds_per_unit
+
+        # suavizamos el ajuste: las etapas en curso se admitieron con el límite anterior
+        target = self._estimate * gradient + math.sqrt(self._estimate)
+        self._estimate = min(max((1 - ADAPT_SMOOTHING) * self._estimate + ADAPT_SMOOTHING * target, 1.0), float(self.max_limit))
+        new_limit = round(self._estimate)
+        if new_limit != self.limit:
+            logger.info(f"Límite de '{self.name}': {self.limit} -> {new_limit} (tiempo por unidad x{1 / gradient:.2f} sobre el mejor)")
+            self.limit = new_limit
+
+        self._window_seconds = 0.0
+        self._window_units = 0.0
+        self._window_count = 0
+
+
+# Límites por recurso del proceso, compartidos por todas las tareas
+RESOURCE_LIMITERS: Dict[str, AdaptiveLimiter] = {
+    "sftp": AdaptiveLimiter("sftp", SFTP_CONCURRENCY_LIMIT),
+    "cpu": AdaptiveLimiter("cpu", CPU_CONCURRENCY_LIMIT),
+    "mysql": AdaptiveLimiter("mysql", DB_CONCURRENCY_LIMIT)
+}
+
+
+def resource_slot(resource: str, logger: logging.Logger):
+    """ Ocupa un lugar del recurso 'resource' ("sftp", "cpu" o "mysql") mientras dura el bloque 'with' """
+    return RESOURCE_LIMITERS[resource].slot(logger)
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """ Regresa el pool de procesos compartido del proceso actual (uno por pid), creándolo la primera vez. Los workers
+    se crean con 'spawn' para no heredar locks de los hilos del task runner """
+    pid = os.getpid()
+    with _PROCESS_POOLS_LOCK:
+        pool = _PROCESS_POOLS.get(pid)
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=PROCESS_POOL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            _PROCESS_POOLS[pid] = pool
+        return pool
+
+
+class _RecordCollector(logging.Handler):
+    """ Handler que guarda los registros de logging de un worker para reenviarlos al logger del archivo """
+
+    def __init__(self):
+        super().__init__()
+        self.records: List[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # dejamos el registro serializable: mensaje ya formateado y traceback como texto
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        self.records.append(record)
+
+
+def _call_with_captured_logs(function: Callable, *args: Any):
+    """ Ejecuta 'function' dentro de un worker capturando sus registros de logging y su excepción, si la hay """
+    collector = _RecordCollector()
+    root_logger = logging.getLogger()
+    root_logger.addHandler(collector)
+    root_logger.setLevel(logging.INFO)
+    try:
+        return function(*args), collector.records, None
+    except Exception as e:
+        return None, collector.records, e
+    finally:
+        root_logger.removeHandler(collector)
+
+
+def run_in_process_pool(function: Callable, *args: Any, logger: logging.Logger) -> Any:
+    """ Ejecuta 'function(*args)' en el pool de procesos y espera su resultado. Los registros de logging del worker se
+    reenvían a 'logger' y sus excepciones se relanzan aquí, para que la tarea falle y se reintente como siempre """
+    result, records, error = get_process_pool().submit(_call_with_captured_logs, function, *args).result()
+    for record in records:
+        record.name = logger.name
+        logger.handle(record)
+
+    if error is not None:
+        raise error
+    return result
+
+
+def plan_batches(files: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """ Agrupa los archivos pequeños (hasta BATCH_SMALL_FILE_BYTES) en lotes sin pasar de BATCH_MAX_BYTES ni de
+    BATCH_MAX_FILES; los demás archivos quedan en lotes de uno. Se respeta el orden recibido """
+    batches = []
+    current_batch, current_bytes = [], 0
+    for file_info in files:
+        # los archivos grandes se procesan solos
+        if file_info["size"] > BATCH_SMALL_FILE_BYTES:
+            batches.append([file_info])
+            continue
+
+        # cerramos el lote en curso si el archivo ya no cabe
+        if current_batch and (current_bytes + file_info["size"] > BATCH_MAX_BYTES or len(current_batch) >= BATCH_MAX_FILES):
+            batches.append(current_batch)
+            current_batch, current_bytes = [], 0
+
+        current_batch.append(file_info)
+        current_bytes += file_info["size"]
+
+    if current_batch:
+        batches.append(current_batch)
+
+    return batches
+
+
+class StagePipeline:
+    """ Ejecuta una secuencia de etapas sobre varios elementos (archivos) de forma traslapada: cada etapa tiene sus
+    propios hilos y se comunica con la siguiente por una cola acotada, así el elemento N+1 se descarga mientras el N
+    se transforma y el N-1 se carga. Cada etapa recibe el elemento y regresa el elemento para la siguiente, o None si
+    el elemento ya no continúa. Registra la profundidad de las colas y el tiempo ocioso y bloqueado de cada etapa """
+
+    _DONE = object()    # marca de fin para los hilos de una etapa
+
+    def __init__(self, stages: List[Tuple[str, Callable[[Any], Any], int]], logger: logging.Logger, queue_depth: int = PIPELINE_QUEUE_DEPTH):
+        self.stages = stages
+        self.logger = logger
+        self.queues = [queue.Queue(maxsize=max(queue_depth, 1)) for _ in stages]
+        self.metrics = {
+            name: {"busy": 0.0, "idle": 0.0, "blocked": 0.0, "items": 0, "max_depth": 0, "depth_total": 0}
+            for name, _, _ in stages
+        }
+        self.errors: List[Tuple[str, Any, Exception]] = []
+        self._lock = threading.Lock()
+        self._running_workers = [workers for _, _, workers in stages]
+
+    def _put(self, stage_index: int, item: Any) -> float:
+        """ Envía un elemento a la cola de la etapa 'stage_index' y regresa el tiempo bloqueado por la cola llena """
+        start = time.perf_counter()
+        self.queues[stage_index].put(item)
+        return time.perf_counter() - start
+
+    def _worker(self, stage_index: int) -> None:
+        """ Hilo de una etapa: toma elementos de su cola, los procesa y los pasa a la siguiente """
+        name, function, _ = self.stages[stage_index]
+        metrics = self.metrics[name]
+        input_queue = self.queues[stage_index]
+        is_last = stage_index == len(self.stages) - 1
+
+        while True:
+            # tiempo ocioso: esperando trabajo de la etapa anterior (la profundidad se toma antes de sacar el elemento)
+            start = time.perf_counter()
+            depth = input_queue.qsize()
+            item = input_queue.get()
+            idle = time.perf_counter() - start
+            if item is self._DONE:
+                with self._lock:
+                    metrics["idle"] += idle
+                break
+
+            start = time.perf_counter()
+            try:
+                result = function(item)
+            except Exception as e:
+                with self._lock:
+                    self.errors.append((name, item, e))
+                result = None
+            busy = time.perf_counter() - start
+
+            blocked = self._put(stage_index + 1, result) if result is not None and not is_last else 0.0
+            with self._lock:
+                metrics["idle"] += idle
+                metrics["busy"] += busy
+                metrics["blocked"] += blocked
+                metrics["items"] += 1
+                metrics["max_depth"] = max(metrics["max_depth"], depth)
+                metrics["depth_total"] += depth
+
+        # el último hilo de la etapa avisa el fin a todos los hilos de la siguiente
+        with self._lock:
+            self._running_workers[stage_index] -= 1
+            last_worker = self._running_workers[stage_index] == 0
+        if last_worker and not is_last:
+            for _ in range(self.stages[stage_index + 1][2]):
+                self.queues[stage_index + 1].put(self._DONE)
+
+    def run(self, items: Iterable[Any]) -> List[Tuple[str, Any, Exception]]:
+        """ Procesa todos los elementos y regresa los errores (etapa, elemento, excepción). Los hilos corren con una
+        copia del contexto actual, así las tareas de Prefect que llaman quedan dentro de la corrida del flujo """
+        threads = [
+            threading.Thread(target=contextvars.copy_context().run, args=(self._worker, stage_index), daemon=True)
+            for stage_index, (_, _, workers) in enumerate(self.stages)
+            for _ in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        # alimentamos la primera etapa respetando el tamaño de su cola
+        for item in items:
+            self.queues[0].put(item)
+        for _ in range(self.stages[0][2]):
+            self.queues[0].put(self._DONE)
+
+        for thread in threads:
+            thread.join()
+
+        self.report()
+        return self.errors
+
+    def report(self) -> None:
+        """ Registra por etapa: elementos procesados, tiempo ocupado, ocioso (sin trabajo) y bloqueado (siguiente cola
+        llena), y la profundidad promedio y máxima de su cola de entrada """
+        for name, _, workers in self.stages:
+            metrics = self.metrics[name]
+            average_depth = metrics["depth_total"] / metrics["items"] if metrics["items"] else 0.0
+            self.logger.info(
+                f"Etapa '{name}' ({workers} hilos): {metrics['items']} archivos, ocupada {metrics['busy']:.2f}s, "
+                f"ociosa {metrics['idle']:.2f}s, bloqueada {metrics['blocked']:.2f}s, "
+                f"cola promedio {average_depth:.1f} (máx. {metrics['max_depth']})"
+            )
+
+
 def setup_logger(filename: str) -> logging.Logger:
     """ Setup de la configuración de logger """
     # fecha estandarizada
-    log_date = datetime.now().strftime('%d%m%y')
+    log_date = datetime.datetime.now().strftime('%d%m%y')
 
     # directorio del log del archivo que será procesado
-    log_dir = os.getenv("DIR_LOGS") / log_date
+    log_dir = Path(os.getenv("DIR_LOGS", "logs")) / log_date
     log_dir.mkdir(parents=True, exist_ok=True)  # asegurar que el directorio donde se guardan estos logs existe, sino crearlo
 
     # configuración del logger
     logger = logging.getLogger(filename)
     logger.setLevel(logging.INFO)   # nivel de debug
 
-    # establecer el logger
-    handler = logging.FileHandler(log_dir / f"{filename}.log")
-    logger.addHandler(handler)
+    # establecer el logger (una sola vez, aunque el flujo se reintente)
+    if not logger.handlers:
+        handler = logging.FileHandler(log_dir / f"{filename}.log")
+        logger.addHandler(handler)
     
     return logger
\ No newline at end of file
@@ -1,13 +1,64 @@
-from sqlalchemy import text
-from sqlalchemy import Connection
+from contextlib import contextmanager
+from sqlalchemy import bindparam, text, create_engine, event
+from sqlalchemy import Connection, Engine
+from sqlalchemy.pool import QueuePool
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+from pathlib import Path
+from utils.utils_flows import DB_CONCURRENCY_LIMIT
 
 
 import pandas as pd
+import threading
+import tempfile
+import logging
+import time
+import csv
+import io
 import os
 
 
+# Configuración del pool de conexiones compartido
+POOL_MAX_OVERFLOW = int(os.getenv("MYSQL_POOL_OVERFLOW", 0))       # conexiones extra permitidas sobre el límite
+POOL_RECYCLE_SECONDS = int(os.getenv("MYSQL_POOL_RECYCLE", 1800))   # reciclar conexiones antes del wait_timeout de mysql
+POOL_TIMEOUT_SECONDS = int(os.getenv("MYSQL_POOL_TIMEOUT", 300))    # espera máxima por una conexión libre
+
+# Registro de engines por proceso, indexado por (pid, connection string)
+_ENGINES: Dict[Tuple[int, str], Engine] = {}
+_ENGINES_LOCK = threading.Lock()
+
+# Estadísticas de uso del pool por engine
+_POOL_STATS: Dict[Engine, Dict[str, float]] = {}
+
+# Estrategia de carga masiva para 'estadisticas' y 'errores': "executemany", "multi" o "infile"
+BULK_LOADER = os.getenv("BULK_LOADER", "executemany")   # pymysql ya reescribe el executemany en INSERTs multi-fila
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", 5000))     # registros por INSERT multi-fila
+
+# Tabla temporal (por sesión) para el upsert de visitantes
+VISITORS_STAGING_TABLE = "visitantes_staging"
+
+# Estatus en 'bitacora' de los deltas de visitantes de una corrida ya aplicados (modo coalescido)
+VISITORS_DELTAS_STATUS = "Deltas aplicados"
+
+# Máximo de parámetros por sentencia en sqlite (base embebida que sustituye a mysql en benchmarks y pruebas)
+SQLITE_MAX_VARIABLES = 32766
+
+
+def read_stage_output(source: Union[pd.DataFrame, Path]) -> pd.DataFrame:
+    """ Esta función entrega una tabla de salida de la transformación: un dataframe se usa tal cual y un archivo
+    Arrow IPC se lee con memory map, sin cargar ni deserializar el archivo completo en un buffer intermedio """
+    if isinstance(source, pd.DataFrame):
+        return source
+
+    import pyarrow as pa    # dependencia opcional, sólo se usa con STAGE_HANDOFF="arrow"
+    return pa.ipc.open_file(pa.memory_map(str(source), "r")).read_all().to_pandas()
+
+
 def create_mysql_connection_url() -> str:
-    """ Configuración del mysql connection string para sqlalchemy """
+    """ Configuración del mysql connection string para sqlalchemy. Si se define DATABASE_URL se usa tal cual (por
+    ejemplo, la base sqlite que sustituye a mysql en el arnés de benchmarks) """
+    if os.getenv("DATABASE_URL"):
+        return os.getenv("DATABASE_URL")
+
     # leer las credenciales del servidor mysql
     host = os.getenv("HOST_MYSQL")
     port = os.getenv("PORT_MYSQL")
@@ -21,94 +72,388 @@ def create_mysql_connection_url() -> str:
     return connection_string
 
 
-def load_statistics_table(stats_df: pd.DataFrame, conn: Connection) -> None:
-    """ Esta función carga un datarame de estadisticas a su tabla correspondiente en sql """
-    stats_df.to_sql(
-        name="estadisticas",
+def enable_sqlite_foreign_keys(engine: Engine) -> None:
+    """ Esta función activa la validación de llaves foráneas en cada conexión de un engine sqlite (desactivada por
+    defecto en sqlite), para que la base embebida rechace los mismos registros que mysql """
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_foreign_keys(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA foreign_keys = ON")
+
+
+def get_mysql_engine(connection_url: Optional[str] = None) -> Engine:
+    """ Esta función regresa el engine compartido del proceso para un connection string, creándolo la primera vez.
+    Así las conexiones del pool se reutilizan entre micro-batches en lugar de crear un pool nuevo por archivo """
+    connection_url = connection_url or create_mysql_connection_url()
+    engine_key = (os.getpid(), connection_url)     # un proceso hijo nunca reutiliza el pool del padre
+
+    with _ENGINES_LOCK:
+        engine = _ENGINES.get(engine_key)
+        if engine is None:
+            engine = create_engine(
+                connection_url,
+                poolclass=QueuePool,
+                pool_size=DB_CONCURRENCY_LIMIT,     # tantas conexiones como cargas simultáneas permitidas
+                max_overflow=POOL_MAX_OVERFLOW,
+                pool_timeout=POOL_TIMEOUT_SECONDS,
+                pool_pre_ping=True,     # descartamos conexiones muertas antes de usarlas
+                pool_recycle=POOL_RECYCLE_SECONDS,
+                connect_args={"local_infile": True} if BULK_LOADER == "infile" else {}
+            )
+            enable_sqlite_foreign_keys(engine)
+            _ENGINES[engine_key] = engine
+            _POOL_STATS[engine] = {"checkouts": 0, "total_wait": 0.0, "max_wait": 0.0}
+
+    return engine
+
+
+@contextmanager
+def mysql_transaction(engine: Engine, logger: logging.Logger):
+    """ Esta función abre una transacción con una conexión del pool y registra en el log el tiempo de espera por ella """
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        wait_seconds = time.perf_counter() - start
+
+        # actualizamos las estadísticas del pool
+        with _ENGINES_LOCK:
+            stats = _POOL_STATS.setdefault(engine, {"checkouts": 0, "total_wait": 0.0, "max_wait": 0.0})
+            stats["checkouts"] += 1
+            stats["total_wait"] += wait_seconds
+            stats["max_wait"] = max(stats["max_wait"], wait_seconds)
+
+        logger.info(
+            f"Conexión MySQL obtenida en {wait_seconds:.3f}s "
+            f"(checkouts: {stats['checkouts']}, espera promedio: {stats['total_wait'] / stats['checkouts']:.3f}s, "
+            f"espera máxima: {stats['max_wait']:.3f}s). Pool: {engine.pool.status()}"
+        )
+        yield conn
+
+
+def bulk_insert_executemany(df: pd.DataFrame, table_name: str, conn: Connection) -> None:
+    """ Esta función inserta un dataframe con el comportamiento por defecto de to_sql (executemany fila por fila) """
+    df.to_sql(
+        name=table_name,
         con=conn,
         if_exists='append',
         index=False
     )
 
 
-def load_staging_visitors_table(visitors_df: pd.DataFrame, staging_table_name: str, conn: Connection) -> None:
-    """ Esta función se encarga una dataframe temporal de visitantes a su tabla corrspondiente en sql """
-    visitors_df.to_sql(
-        name=staging_table_name,
-        con =conn,
-        if_exists='replace',
-        index=False
+def bulk_insert_multi(df: pd.DataFrame, table_name: str, conn: Connection) -> None:
+    """ Esta función inserta un dataframe mediante sentencias INSERT multi-fila de BULK_BATCH_SIZE registros """
+    # en sqlite cada INSERT multi-fila está acotado por el máximo de parámetros por sentencia
+    chunksize = BULK_BATCH_SIZE
+    if conn.dialect.name == "sqlite":
+        chunksize = min(chunksize, SQLITE_MAX_VARIABLES // max(len(df.columns), 1))
+
+    df.to_sql(
+        name=table_name,
+        con=conn,
+        if_exists='append',
+        index=False,
+        method="multi",
+        chunksize=chunksize
     )
-    # ejecutar código SQL para upsert en tabla visitantes real
-    incremental_merge_query = text(f"""
-        WITH agregados AS (
-            SELECT * FROM {staging_table_name}
-        )
-        MERGE INTO visitantes AS T
-        USING agregados AS S
-        ON T.email = S.email
-        WHEN MATCHED THEN
-            UPDATE SET
-                fechaPrimeraVisita = CASE
-                                        WHEN S.fechaPrimeraVisita = T.fechaPrimeraVisita
-                                        THEN S.fechaPrimeraVisita
-                                        ELSE T.fechaPrimeraVisita
-                                END,
 
-                fechaUltimaVisita = CASE
-                                    WHEN S.fechaUltimaVisita > T.fechaUltimaVisita
-                                    THEN S.fechaUltimaVisita
-                                    ELSE T.fechaUltimaVisita
-                                END,
 
-                visitasTotales = T.visitasTotales + S.visitasTotales
+def bulk_insert_infile(df: pd.DataFrame, table_name: str, conn: Connection) -> None:
+    """ Esta función inserta un dataframe con LOAD DATA LOCAL INFILE a partir de un buffer CSV generado en memoria """
+    # serializamos el dataframe a CSV en memoria con el formato que espera mysql
+    csv_buffer = io.StringIO()
+    df.to_csv(
+        csv_buffer,
+        index=False,
+        header=False,
+        na_rep="NULL",
+        quoting=csv.QUOTE_MINIMAL,
+        date_format="%Y-%m-%d %H:%M:%S",
+        lineterminator="\n"
+    )
+
+    # pymysql sólo envía LOCAL INFILE desde una ruta, así que volcamos el buffer a un archivo temporal
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", encoding="utf-8", delete=False) as tmp_file:
+        tmp_file.write(csv_buffer.getvalue())
+    csv_buffer.close()
+
+    columns = ", ".join(f"`{column}`" for column in df.columns)
+    load_query = text(f"""
+        LOAD DATA LOCAL INFILE :path
+        INTO TABLE {table_name}
+        CHARACTER SET utf8mb4
+        FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' ESCAPED BY ''
+        LINES TERMINATED BY '\\n'
+        ({columns})
+    """)
+    try:
+        conn.execute(load_query, {"path": tmp_file.name})
+    finally:
+        os.remove(tmp_file.name)
+
+
+# Estrategias de carga masiva disponibles
+BULK_LOADERS: Dict[str, Callable[[pd.DataFrame, str, Connection], None]] = {
+    "executemany": bulk_insert_executemany,
+    "multi": bulk_insert_multi,
+    "infile": bulk_insert_infile
+}
+
+
+def bulk_insert(df: pd.DataFrame, table_name: str, conn: Connection, loader: str = BULK_LOADER) -> float:
+    """ Esta función inserta un dataframe con la estrategia de carga configurada y regresa los segundos que tardó """
+    if loader not in BULK_LOADERS:
+        raise ValueError(f"Estrategia de carga no soportada: {loader}. Opciones: {list(BULK_LOADERS)}")
+
+    start = time.perf_counter()
+    BULK_LOADERS[loader](df, table_name, conn)
+    return time.perf_counter() - start
+
+
+def log_load_throughput(table_name: str, records: int, seconds: float, logger: logging.Logger) -> None:
+    """ Esta función registra en el log el throughput de carga (registros/segundo) de una tabla """
+    throughput = records / seconds if seconds > 0 else 0.0
+    logger.info(f"Tabla '{table_name}': {records} registros en {seconds:.2f}s ({throughput:,.0f} registros/s, carga '{BULK_LOADER}')")
+
+
+def load_statistics_table(stats_df: pd.DataFrame, conn: Connection) -> float:
+    """ Esta función carga un datarame de estadisticas a su tabla correspondiente en sql """
+    return bulk_insert(stats_df, "estadisticas", conn)
+
+
+def insert_records(df: pd.DataFrame, table_name: str, conn: Connection) -> None:
+    """ Esta función inserta un dataframe en una tabla ya existente (por ejemplo una tabla temporal, que to_sql no detecta)
+    mediante INSERTs en lotes de BULK_BATCH_SIZE registros """
+    if BULK_LOADER == "infile":
+        bulk_insert_infile(df, table_name, conn)
+        return
+
+    columns = ", ".join(df.columns)
+    params = ", ".join(f":{column}" for column in df.columns)
+    insert_query = text(f"INSERT INTO {table_name} ({columns}) VALUES ({params})")
+    for start in range(0, len(df), BULK_BATCH_SIZE):
+        records = df.iloc[start:start + BULK_BATCH_SIZE].to_dict("records")
+        conn.execute(insert_query, records)     # pymysql agrupa el executemany en INSERTs multi-fila
+
+
+# Upsert de visitantes equivalente en sqlite: 'excluded' es el registro nuevo y todas las asignaciones comparan
+# contra el valor previo del registro
+SQLITE_VISITORS_UPSERT_QUERY = text(f"""
+    INSERT INTO visitantes (email, fechaPrimeraVisita, fechaUltimaVisita, visitasTotales, visitasAnioActual, visitasMesActual)
+    SELECT S.email, S.fechaPrimeraVisita, S.fechaUltimaVisita, S.visitasTotales, S.visitasAnioActual, S.visitasMesActual
+    FROM {VISITORS_STAGING_TABLE} AS S
+    WHERE true
+    ON CONFLICT (email) DO UPDATE SET
+        visitasAnioActual = CASE
+                                WHEN strftime('%Y', visitantes.fechaUltimaVisita) = strftime('%Y', 'now', 'localtime')
+                                THEN visitantes.visitasAnioActual + excluded.visitasAnioActual
+                                ELSE excluded.visitasAnioActual
+                            END,
+
+        visitasMesActual = CASE
+                                WHEN strftime('%Y', visitantes.fechaUltimaVisita) = strftime('%Y', 'now', 'localtime')
+                                AND strftime('%m', visitantes.fechaUltimaVisita) = strftime('%m', excluded.fechaUltimaVisita)
+                                THEN visitantes.visitasMesActual + excluded.visitasMesActual
+                                ELSE excluded.visitasMesActual
+                            END,
+
+        visitasTotales = visitantes.visitasTotales + excluded.visitasTotales,
+
+        fechaPrimeraVisita = CASE
+                                WHEN visitantes.fechaPrimeraVisita IS NULL
+                                THEN excluded.fechaPrimeraVisita
+                                WHEN excluded.fechaPrimeraVisita = visitantes.fechaPrimeraVisita
+                                THEN excluded.fechaPrimeraVisita
+                                ELSE visitantes.fechaPrimeraVisita
+                            END,
+
+        fechaUltimaVisita = CASE
+                                WHEN visitantes.fechaUltimaVisita IS NULL
+                                OR excluded.fechaUltimaVisita > visitantes.fechaUltimaVisita
+                                THEN excluded.fechaUltimaVisita
+                                ELSE visitantes.fechaUltimaVisita
+                            END
+""")
+
+
+def load_staging_visitors_table(visitors_df: pd.DataFrame, conn: Connection) -> None:
+    """ Esta función carga el dataframe de visitantes a una tabla temporal de la sesión y hace el upsert
+    en la tabla visitantes real. Con sqlite (sustituto embebido de mysql) se usa su sintaxis de upsert """
+    if conn.dialect.name == "sqlite":
+        drop_staging_query = text(f"DROP TABLE IF EXISTS temp.{VISITORS_STAGING_TABLE}")
+    else:
+        drop_staging_query = text(f"DROP TEMPORARY TABLE IF EXISTS {VISITORS_STAGING_TABLE}")
+
+    # tabla temporal de la sesión: no genera DDL compartido ni locks de metadatos entre workers concurrentes
+    conn.execute(drop_staging_query)  # la conexión del pool pudo conservarla
+    conn.execute(text(f"""
+        CREATE TEMPORARY TABLE {VISITORS_STAGING_TABLE} (
+            email VARCHAR(255) NOT NULL,
+            fechaPrimeraVisita DATE,
+            fechaUltimaVisita DATE,
+            visitasTotales INT,
+            visitasAnioActual INT,
+            visitasMesActual INT,
 
-                visitasAnioActual = CASE
-                                    WHEN EXTRACT(YEAR FROM T.fechaUltimaVisita) = EXTRACT(YEAR FROM CURRENT_DATE)
-                                    THEN T.visitasAnioActual + S.visitasAnioActual
+            PRIMARY KEY (email)
+        )
+    """))
+    insert_records(visitors_df, VISITORS_STAGING_TABLE, conn)
+
+    # upsert en tabla visitantes real. mysql evalúa las asignaciones de izquierda a derecha, por lo que
+    # fechaUltimaVisita se actualiza al final para que los CASE anteriores comparen contra su valor previo.
+    # Un registro reservado por reserve_visitors_keys (sin fechas ni visitas) queda igual que un email nuevo
+    incremental_upsert_query = text(f"""
+        INSERT INTO visitantes (email, fechaPrimeraVisita, fechaUltimaVisita, visitasTotales, visitasAnioActual, visitasMesActual)
+        SELECT S.email, S.fechaPrimeraVisita, S.fechaUltimaVisita, S.visitasTotales, S.visitasAnioActual, S.visitasMesActual
+        FROM {VISITORS_STAGING_TABLE} AS S
+        ON DUPLICATE KEY UPDATE
+            visitasAnioActual = CASE
+                                    WHEN YEAR(visitantes.fechaUltimaVisita) = YEAR(CURRENT_DATE)
+                                    THEN visitantes.visitasAnioActual + S.visitasAnioActual
                                     ELSE S.visitasAnioActual
                                 END,
 
-                visitasMesActual = CASE
-                                    WHEN EXTRACT(YEAR FROM T.fechaUltimaVisita) = EXTRACT(YEAR FROM CURRENT_DATE)
-                                    AND EXTRACT(MONTH FROM T.fechaUltimaVisita) = EXTRACT(MONTH FROM S.fechaUltimaVisita)
-                                    THEN T.visitasMesActual + S.visitasMesActual
+            visitasMesActual = CASE
+                                    WHEN YEAR(visitantes.fechaUltimaVisita) = YEAR(CURRENT_DATE)
+                                    AND MONTH(visitantes.fechaUltimaVisita) = MONTH(S.fechaUltimaVisita)
+                                    THEN visitantes.visitasMesActual + S.visitasMesActual
                                     ELSE S.visitasMesActual
                                 END,
-        
-        WHEN NOT MATCHED BY TARGET THEN
-            INSERT (email, fechaPrimeraVisita, fechaUltimaVisita, visitasTotales, visitasAnioActual, visitasMesActual)
-            VALUES (S.email, S.fechaPrimeraVisita, S.fechaUltimaVisita, S.visitasTotales, S.visitasAnioActual, S.visitasMesActual);
-    """
+
+            visitasTotales = visitantes.visitasTotales + S.visitasTotales,
+
+            fechaPrimeraVisita = CASE
+                                    WHEN visitantes.fechaPrimeraVisita IS NULL
+                                    THEN S.fechaPrimeraVisita
+                                    WHEN S.fechaPrimeraVisita = visitantes.fechaPrimeraVisita
+                                    THEN S.fechaPrimeraVisita
+                                    ELSE visitantes.fechaPrimeraVisita
+                                END,
+
+            fechaUltimaVisita = CASE
+                                    WHEN visitantes.fechaUltimaVisita IS NULL
+                                    OR S.fechaUltimaVisita > visitantes.fechaUltimaVisita
+                                    THEN S.fechaUltimaVisita
+                                    ELSE visitantes.fechaUltimaVisita
+                                END
+    """)
+    if conn.dialect.name == "sqlite":
+        incremental_upsert_query = SQLITE_VISITORS_UPSERT_QUERY
+    conn.execute(incremental_upsert_query)
+    conn.execute(drop_staging_query)  # liberamos la tabla temporal
+
+
+def reserve_visitors_keys(emails: pd.Series, conn: Connection) -> None:
+    """ Esta función inserta en 'visitantes' los emails que aún no existen con un registro reservado (sin fechas y con
+    cero visitas), para que las filas de 'estadisticas' cumplan su llave foránea antes de que llegue el upsert de sus
+    visitas (al final del archivo en modo streaming o al final de la corrida en modo coalescido).
+    Los emails existentes se descartan con un SELECT (lectura consistente, sin locks) y sólo se insertan los faltantes,
+    así las cargas concurrentes no toman locks exclusivos sobre los visitantes más frecuentes """
+    if conn.dialect.name == "sqlite":
+        insert_clause = "INSERT OR IGNORE"
+    else:
+        insert_clause = "INSERT IGNORE"     # otra carga pudo reservar el email entre el SELECT y el INSERT
+
+    existing_query = text("SELECT email FROM visitantes WHERE email IN :emails").bindparams(
+        bindparam("emails", expanding=True)
     )
-    conn.execute(incremental_merge_query)   
-    conn.execute(f"DROP TABLE  IF EXISTS {staging_table_name}")  # borramos tabla temporal
+    reserve_query = text(f"""
+        {insert_clause} INTO visitantes (email, visitasTotales, visitasAnioActual, visitasMesActual)
+        VALUES (:email, 0, 0, 0)
+    """)
 
+    # en sqlite cada IN está acotado por el máximo de parámetros por sentencia
+    batch_size = BULK_BATCH_SIZE
+    if conn.dialect.name == "sqlite":
+        batch_size = min(batch_size, SQLITE_MAX_VARIABLES)
 
-def load_errors_table(errors_df: pd.DataFrame, conn: Connection) -> None:
-    """ Esta función carga un datarame de estadisticas a su tabla correspondiente en sql """
-    errors_df.to_sql(
-        name="errores",
+    unique_emails = emails.dropna().unique().tolist()
+    for start in range(0, len(unique_emails), batch_size):
+        batch = unique_emails[start:start + batch_size]
+        existing = set(conn.execute(existing_query, {"emails": batch}).scalars())
+        records = [{"email": email} for email in batch if email not in existing]
+        if records:
+            conn.execute(reserve_query, records)     # pymysql agrupa el executemany en INSERTs multi-fila
+
+
+def write_visitors_delta(visitors_df: pd.DataFrame, deltas_dir: Path, filename: str) -> Path:
+    """ Esta función persiste localmente el delta de visitantes de un archivo para aplicarlo al final de la corrida.
+    Se escribe con extensión .tmp y se publica (rename) sólo cuando la carga del archivo hizo commit """
+    deltas_dir.mkdir(parents=True, exist_ok=True)
+    delta_tmp_path = deltas_dir / f"{filename}.csv.tmp"
+    visitors_df.to_csv(delta_tmp_path, index=False)
+
+    return delta_tmp_path
+
+
+def iter_visitors_deltas(deltas_dir: Path) -> Iterator[pd.DataFrame]:
+    """ Esta función lee uno a uno los deltas de visitantes publicados en el directorio de la corrida, omitiendo los
+    que no tienen registros """
+    for delta_path in sorted(deltas_dir.glob("*.csv")):
+        delta_df = pd.read_csv(delta_path)
+        if len(delta_df) == 0:
+            continue
+
+        for column in ["fechaPrimeraVisita", "fechaUltimaVisita"]:
+            delta_df[column] = pd.to_datetime(delta_df[column], errors="coerce").dt.date
+        yield delta_df
+
+
+def list_pending_deltas_dirs(deltas_root: Path) -> List[Path]:
+    """ Esta función regresa los directorios de deltas de visitantes de corridas anteriores que no llegaron a
+    aplicarse (por ejemplo, porque el orquestador se detuvo antes del final de la corrida) """
+    if not deltas_root.is_dir():
+        return []
+    return sorted(path for path in deltas_root.iterdir() if path.is_dir())
+
+
+def visitors_deltas_log_name(deltas_dir: Path) -> str:
+    """ Esta función regresa el nombre con el que se registra en 'bitacora' la aplicación de los deltas de una corrida """
+    return f"deltas_visitantes/{deltas_dir.name}"
+
+
+def visitors_deltas_applied(deltas_dir: Path, conn: Connection) -> bool:
+    """ Esta función indica si los deltas de visitantes de una corrida ya se aplicaron (su registro en 'bitacora' se
+    escribe en la misma transacción que el upsert), para no volver a sumar sus visitas si el directorio no se borró """
+    applied_query = text("SELECT 1 FROM bitacora WHERE nombreArchivo = :name AND estatus = :status LIMIT 1")
+    params = {"name": visitors_deltas_log_name(deltas_dir), "status": VISITORS_DELTAS_STATUS}
+    return conn.execute(applied_query, params).first() is not None
+
+
+def record_visitors_deltas(deltas_dir: Path, emails_count: int, conn: Connection) -> None:
+    """ Esta función registra en 'bitacora' la aplicación de los deltas de visitantes de una corrida, con los emails
+    actualizados como registros exitosos """
+    bitacora_dict = {
+        "nombreArchivo": visitors_deltas_log_name(deltas_dir),
+        "registrosExitosos": emails_count,
+        "registrosFallidos": 0,
+        "estatus": VISITORS_DELTAS_STATUS
+    }
+    pd.DataFrame([bitacora_dict]).to_sql(
+        name="bitacora",
         con=conn,
         if_exists='append',
         index=False
     )
 
 
-def load_log_table(filename: str, stats_df: pd.DataFrame, errors_df: pd.DataFrame, conn: Connection) -> None:
+def load_errors_table(errors_df: pd.DataFrame, conn: Connection) -> float:
+    """ Esta función carga un datarame de estadisticas a su tabla correspondiente en sql """
+    return bulk_insert(errors_df, "errores", conn)
+
+
+def load_log_table(filename: str, valid_records: int, invalid_records: int, conn: Connection) -> None:
     """ Esta función carga un registro nuevo en la tabla 'bitacora' """
     bitacora_dict = {
         "nombreArchivo": filename,
-        "registrosExitosos": len(stats_df),
-        "registrosFallidos": len(errors_df),
-        "estatus": "Completado" if len(errors_df) > 0 else "Completado con errores"
+        "registrosExitosos": valid_records,
+        "registrosFallidos": invalid_records,
+        "estatus": "Completado con errores" if invalid_records > 0 else "Completado"
     }
-    pd.DataFrame(bitacora_dict).to_sql(
+    pd.DataFrame([bitacora_dict]).to_sql(
         name="bitacora",
         con=conn,
         if_exists='append',
     index=False 
     )
-
-
-
@@ -1,15 +1,19 @@
 from utils.utils_extract import sftp_connection
+from utils.utils_transform import stage_outputs_dir
+from pathlib import Path
 
+import posixpath
+import shutil
 import datetime
 import zipfile
 import os
 
 
-def move_to_backup(filepath: str) -> None:
+def move_to_backup(filepath: Path) -> None:
     """ Esta función mueve un archivo descargado hasta el directorio del backup """
     # creamos directorio del backuo si no existe
-    backup_dir = os.getenv("DIR_BACKUP")
-    backup_dir.mkdir(parents=True, exists_ok=True)
+    backup_dir = Path(os.getenv("DIR_BACKUP", "backup"))
+    backup_dir.mkdir(parents=True, exist_ok=True)
 
     # creamos el path del archivo en el backup
     backup_path = backup_dir / filepath.name
@@ -18,24 +22,30 @@ def move_to_backup(filepath: str) -> None:
     filepath.rename(backup_path)
 
 
-def remove_from_sftp(filepath):
+def remove_from_sftp(filename: str) -> None:
     """ Esta función remueve el archivo del directorio original en el servidor sftp """
     # definimos el directorio original
-    sftp_dir = os.getenv("DIR_SFTP")
+    sftp_dir = os.getenv("DIR_SFTP", ".")
 
     # definimos el directorio del archivo original
-    sftp_path = sftp_dir / filepath.name
+    sftp_path = posixpath.join(sftp_dir, filename)
 
     # removemos el archivo
     with sftp_connection() as sftp:
         sftp.remove(sftp_path)
 
 
+def remove_stage_outputs(filename: str) -> None:
+    """ Esta función borra las salidas columnares de la transformación de un archivo ya cargado """
+    shutil.rmtree(stage_outputs_dir(filename), ignore_errors=True)
+
+
 def zip_compress() -> None:
     """Esta función encapsula varios archivos descargados y los comprime en un .zip """
     # definimos el directorio y la lista de archivos para el backup
-    backup_dir = os.getenv("DIR_BACKUP")
-    files_backup = [file for file in os.listdir(backup_dir) if file.startswith("report_") and file.endswith(".txt")]
+    backup_dir = Path(os.getenv("DIR_BACKUP", "backup"))
+    backup_dir.mkdir(parents=True, exist_ok=True)
+    files_backup = [file for file in backup_dir.iterdir() if file.name.startswith("report_") and file.name.endswith(".txt")]
     
 
     # creamos la ruta del .zip backup de hoy
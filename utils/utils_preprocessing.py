@@ -0,0 +1,165 @@
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Set
+
+import threading
+import datetime
+import sqlite3
+import os
+
+
+# Base de datos embebida con el manifiesto de archivos ya procesados
+MANIFEST_DB = os.getenv("MANIFEST_DB", "manifest.db")
+
+# Máximo de parámetros por consulta IN (...) en sqlite
+SQLITE_MAX_PARAMS = 900
+
+# Detección de archivos re-entregados con otro nombre (mismo sha256) y de registros ya cargados
+DEDUPLICATE_FILES = os.getenv("DEDUPLICATE_FILES", "true").lower() == "true"
+DEDUPLICATE_ROWS = os.getenv("DEDUPLICATE_ROWS", "true").lower() == "true"
+ROW_HASH_RETENTION_DAYS = int(os.getenv("ROW_HASH_RETENTION_DAYS", 90))    # días que se conservan los hashes de registros
+
+# Contenido (sha256) de los archivos en vuelo en este proceso, para detectar re-entregas dentro de la misma corrida
+_IN_FLIGHT_FILES: Dict[str, str] = {}
+_IN_FLIGHT_LOCK = threading.Lock()
+
+
+@contextmanager
+def manifest_connection(db_path: Optional[str] = None):
+    """ Set up de la conexión al manifiesto local, creando la tabla si no existe """
+    conn = sqlite3.connect(db_path or MANIFEST_DB, timeout=30)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")     # lecturas concurrentes mientras otro worker escribe
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS archivos_procesados (
+                nombreArchivo TEXT NOT NULL,
+                tamanio INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                sha256 TEXT,
+                fechaProceso TEXT NOT NULL,
+
+                PRIMARY KEY (nombreArchivo, tamanio, mtime)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_archivos_sha256 ON archivos_procesados (sha256)")
+        # índice de hashes de registros: 'confirmado' = 0 mientras el archivo no termina de cargarse
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS registros_procesados (
+                hash BLOB NOT NULL PRIMARY KEY,
+                nombreArchivo TEXT NOT NULL,
+                confirmado INTEGER NOT NULL DEFAULT 0,
+                fechaProceso TEXT NOT NULL
+            ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_registros_archivo ON registros_procesados (nombreArchivo)")
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def filter_new_files(files: List[Dict[str, Any]], db_path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """ Función que regresa sólo los archivos nuevos o modificados, comparando nombre, tamaño y fecha de modificación
+    contra el manifiesto. Sólo se consultan los nombres listados, así el costo no crece con el histórico """
+    processed = set()
+    with manifest_connection(db_path) as conn:
+        filenames = [file["filename"] for file in files]
+        for start in range(0, len(filenames), SQLITE_MAX_PARAMS):
+            batch = filenames[start:start + SQLITE_MAX_PARAMS]
+            rows = conn.execute(
+                f"SELECT nombreArchivo, tamanio, mtime FROM archivos_procesados "
+                f"WHERE nombreArchivo IN ({', '.join('?' * len(batch))})",
+                batch
+            )
+            processed.update(rows)
+
+    return [file for file in files if (file["filename"], file["size"], file["mtime"]) not in processed]
+
+
+def record_processed_file(filename: str, size: int, mtime: int, sha256: Optional[str], db_path: Optional[str] = None) -> None:
+    """ Función que registra un archivo como procesado en el manifiesto. Si el archivo ya estaba registrado se conserva
+    su sha256 cuando no se recibe uno (por ejemplo, un reintento cuando la copia local ya se movió al backup) """
+    with manifest_connection(db_path) as conn:
+        conn.execute(
+            "INSERT INTO archivos_procesados (nombreArchivo, tamanio, mtime, sha256, fechaProceso) "
+            "VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (nombreArchivo, tamanio, mtime) DO UPDATE SET "
+            "sha256 = COALESCE(excluded.sha256, archivos_procesados.sha256), fechaProceso = excluded.fechaProceso",
+            (filename, size, mtime, sha256, datetime.datetime.now().isoformat(timespec="seconds"))
+        )
+
+
+def find_duplicate_file(sha256: Optional[str], db_path: Optional[str] = None) -> Optional[str]:
+    """ Función que busca en el manifiesto un archivo ya procesado con el mismo contenido (sha256) y regresa su nombre """
+    if sha256 is None:
+        return None
+
+    with manifest_connection(db_path) as conn:
+        row = conn.execute("SELECT nombreArchivo FROM archivos_procesados WHERE sha256 = ? LIMIT 1", (sha256,)).fetchone()
+
+    return row[0] if row is not None else None
+
+
+def claim_in_flight_file(sha256: str, filename: str) -> Optional[str]:
+    """ Función que registra el contenido (sha256) de un archivo que se está procesando en esta corrida. Si otro archivo
+    en vuelo ya tiene el mismo contenido regresa su nombre: es una re-entrega que el manifiesto todavía no conoce """
+    with _IN_FLIGHT_LOCK:
+        owner = _IN_FLIGHT_FILES.setdefault(sha256, filename)
+    return owner if owner != filename else None
+
+
+def release_in_flight_file(filename: str) -> None:
+    """ Función que libera el contenido registrado por un archivo que falló, para que una re-entrega se pueda cargar """
+    with _IN_FLIGHT_LOCK:
+        for sha256 in [sha256 for sha256, owner in _IN_FLIGHT_FILES.items() if owner == filename]:
+            del _IN_FLIGHT_FILES[sha256]
+
+
+def select_seen_rows(conn: sqlite3.Connection, hashes: List[bytes]) -> Set[bytes]:
+    """ Función que consulta cuáles de los hashes ya están en el índice: confirmados, o pendientes de cualquier archivo
+    que se está cargando (incluida una re-entrega con otro nombre en la misma corrida). Usa un join contra una tabla
+    temporal en lugar de IN (...) """
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS hashes_consulta (hash BLOB PRIMARY KEY) WITHOUT ROWID")
+    conn.execute("DELETE FROM hashes_consulta")
+    conn.executemany("INSERT OR IGNORE INTO hashes_consulta (hash) VALUES (?)", ((row_hash,) for row_hash in hashes))
+    rows = conn.execute("SELECT r.hash FROM registros_procesados r JOIN hashes_consulta c ON c.hash = r.hash")
+    return {row[0] for row in rows}
+
+
+def claim_rows(filename: str, hashes: List[bytes], db_path: Optional[str] = None) -> Set[bytes]:
+    """ Función que en una sola transacción de escritura regresa los hashes ya vistos (ver select_seen_rows) y registra
+    los demás como pendientes del archivo. Los fragmentos de un mismo archivo que se transforman en paralelo (hilos o
+    procesos) y los archivos en vuelo se serializan en el bloqueo de sqlite, así un registro repetido se carga una sola
+    vez. Si el archivo falla, sus hashes pendientes se liberan con reset_pending_rows """
+    now = datetime.datetime.now().isoformat(timespec="seconds")
+    with manifest_connection(db_path) as conn:
+        conn.execute("BEGIN IMMEDIATE")     # tomamos el bloqueo de escritura antes de consultar
+        seen = select_seen_rows(conn, hashes)
+        conn.executemany(
+            "INSERT OR IGNORE INTO registros_procesados (hash, nombreArchivo, confirmado, fechaProceso) VALUES (?, ?, 0, ?)",
+            ((row_hash, filename, now) for row_hash in hashes if row_hash not in seen)
+        )
+        return seen
+
+
+def reset_pending_rows(filename: str, db_path: Optional[str] = None) -> None:
+    """ Función que descarta los hashes pendientes de un intento anterior del archivo antes de volver a transformarlo """
+    with manifest_connection(db_path) as conn:
+        conn.execute("DELETE FROM registros_procesados WHERE nombreArchivo = ? AND confirmado = 0", (filename,))
+
+
+def confirm_rows(filename: str, db_path: Optional[str] = None) -> None:
+    """ Función que confirma los hashes de registros de un archivo ya cargado """
+    now = datetime.datetime.now().isoformat(timespec="seconds")
+    with manifest_connection(db_path) as conn:
+        conn.execute(
+            "UPDATE registros_procesados SET confirmado = 1, fechaProceso = ? WHERE nombreArchivo = ? AND confirmado = 0",
+            (now, filename)
+        )
+
+
+def purge_expired_rows(retention_days: int = ROW_HASH_RETENTION_DAYS, db_path: Optional[str] = None) -> int:
+    """ Función que borra los hashes de registros confirmados hace más de 'retention_days' días y regresa cuántos se borraron """
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days=retention_days)).isoformat(timespec="seconds")
+    with manifest_connection(db_path) as conn:
+        cursor = conn.execute("DELETE FROM registros_procesados WHERE confirmado = 1 AND fechaProceso < ?", (cutoff,))
+        return cursor.rowcount
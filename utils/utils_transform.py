@@ -1,10 +1,25 @@
-from typing import Tuple, Optional
+from contextlib import contextmanager
+from typing import Any, Dict, Tuple, Optional, Iterator, List, Union
 from pathlib import Path
+from utils.utils_extract import RemoteFileSource, file_sha256
+from utils.utils_flows import STAGE_CACHE_EXPIRATION_HOURS, TRANSFORM_EXECUTOR, SHARD_COUNT, code_version, run_in_process_pool
+from utils.utils_load import read_stage_output
+from utils.utils_preprocessing import DEDUPLICATE_ROWS, claim_rows
+
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
 import numpy as np
+import functools
+import hashlib
+import shutil
+import io
+import time
+import operator
 import datetime
 import logging
+import re
+import os
 
 # Columnas esperadas por archivo
 VALID_COLUMNS = [
@@ -61,26 +76,295 @@ COLUMNS_DATA_TYPES = {
 }
 
 
+# Tipos de pandas con los que se lee cada tipo de COLUMNS_DATA_TYPES (las fechas se leen como texto y se tipan
+# al validarlas, con un solo parseo de formato explícito)
+READER_DTYPES = {
+    "str": "object",
+    "datetime": "object",
+    "int": "Int64"  # entero nullable: los centinelas de nulo no fuerzan la columna a float
+}
+
+# Valores centinela que representan nulos en los archivos. No aplican a las fechas: ahí un '-' o '0' es un error de
+# formato que se reporta en la validación
+NA_SENTINELS = ["-", "0"]
+NA_SENTINEL_COLUMNS = [column for column in VALID_COLUMNS if column not in DATE_COLUMNS]
+
+# Motor de lectura de archivos: "c" (default de pandas) o "pyarrow" (multihilo, requiere la dependencia opcional pyarrow)
+READER_ENGINE = os.getenv("READER_ENGINE", "c")
+
+try:
+    import pyarrow as pa
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+# Representación compacta en memoria: categóricos / strings de Arrow para texto y enteros nullable pequeños
+COMPACT_DTYPES = os.getenv("COMPACT_DTYPES", "false").lower() == "true"
+
+# Columnas de texto con pocos valores distintos, que se representan como categóricas en el modo compacto
+CATEGORICAL_COLUMNS = ["jyv", "Badmail", "Baja", "Navegadores", "Plataformas"]
+
+# Llave del segundo hash de registros (16 caracteres); con dos hashes de 64 bits el riesgo de colisión es despreciable
+ROW_HASH_KEY = "visitas_sitioweb"
+
+# Tipo de error con el que se registran en 'errores' los registros descartados por duplicados
+DUPLICATE_ROW_ERROR = "Duplicado"
+
+# Patrones de validación precompilados
+EMAIL_PATTERN = re.compile(r"^[a-zA-Z0-9][a-zA-Z0-9._%+-]*@[a-zA-Z0-9]([a-zA-Z0-9-]*[a-zA-Z0-9])?(\.[a-zA-Z0-9]([a-zA-Z0-9-]*[a-zA-Z0-9])?)*\.[a-zA-Z]{2,}$")
+DATE_FORMAT = "%d/%m/%Y %H:%M"
+DATE_WIDTH = 16     # las fechas tienen ancho fijo 'dd/mm/YYYY HH:MM'
+
+# Máximo de emails distintos con veredicto en caché (los mismos emails se repiten entre registros y archivos)
+EMAIL_CACHE_SIZE = int(os.getenv("EMAIL_CACHE_SIZE", 200_000))
+
+# Número máximo de registros por bloque en el modo de transformación por bloques (streaming)
+CHUNK_SIZE = int(os.getenv("TRANSFORM_CHUNK_SIZE", 200_000))
+
+# Directorio donde la transformación deja sus salidas columnares para la etapa de carga, una tabla por archivo
+DIR_STAGE_OUTPUTS = os.getenv("DIR_STAGE_OUTPUTS", "staging_path")
+STAGE_OUTPUT_TABLES = ["estadisticas", "visitantes", "errores"]
+STAGE_CACHE_KEY_FILE = "cache_key"   # llave de caché con la que se generaron las salidas
+
+# Versión del código de transformación: cambia si cambia este módulo, los módulos del proyecto que importa o la
+# tarea que lo orquesta
+TRANSFORM_CODE_VERSION = code_version(
+    Path(__file__),
+    *(Path(__file__).parent / f"{module}.py" for module in ["utils_extract", "utils_flows", "utils_load", "utils_preprocessing"]),
+    Path(__file__).parents[1] / "tasks" / "transform.py"
+)
+
+# Configuración que cambia las tablas de salida de la transformación (forma parte de la llave de caché)
+TRANSFORM_SETTINGS = {
+    "DEDUPLICATE_ROWS": DEDUPLICATE_ROWS,
+    "COMPACT_DTYPES": COMPACT_DTYPES,
+    "READER_ENGINE": READER_ENGINE
+}
+
+
+
+class ByteRangeReader(io.RawIOBase):
+    """ Lector de sólo lectura que entrega, uno tras otro, varios rangos de bytes [inicio, fin) de un archivo abierto """
+
+    def __init__(self, file: Any, ranges: List[Tuple[int, int]]):
+        self.file = file
+        self.ranges = list(ranges)
+        self.position = self.ranges[0][0] if self.ranges else 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        while self.ranges:
+            start, end = self.ranges[0]
+            remaining = end - self.position
+            if remaining <= 0:
+                # pasamos al siguiente rango
+                self.ranges.pop(0)
+                self.position = self.ranges[0][0] if self.ranges else 0
+                continue
+
+            self.file.seek(self.position)
+            read = self.file.readinto(memoryview(buffer)[:min(len(buffer), remaining)])
+            self.position += read
+            return read
+
+        return 0
+
+
+class FileShard:
+    """ Fragmento de un archivo de reporte local: el encabezado seguido del rango de bytes [start, end) del cuerpo,
+    que empieza y termina en un límite de línea. Se lee como un archivo completo y conserva el nombre del original,
+    así sus errores y hashes de registros quedan atribuidos al archivo """
+
+    def __init__(self, path: Path, index: int, header_size: int, start: int, end: int):
+        self.path = path
+        self.index = index
+        self.header_size = header_size
+        self.start = start
+        self.end = end
+
+    @property
+    def name(self) -> str:
+        return self.path.name
+
+    @contextmanager
+    def open_stream(self):
+        """ Abre el encabezado más el rango del fragmento como un solo stream con buffer """
+        with open(self.path, "rb") as file:
+            stream = io.BufferedReader(ByteRangeReader(file, [(0, self.header_size), (self.start, self.end)]))
+            try:
+                yield stream
+            finally:
+                stream.close()
+
+
+def split_file_shards(filepath: Path, shard_count: int) -> List[FileShard]:
+    """ Función que parte un archivo local en hasta 'shard_count' fragmentos de tamaño similar, moviendo cada corte
+    al siguiente salto de línea. Los registros del reporte no contienen saltos de línea dentro de sus campos """
+    size = filepath.stat().st_size
+    with open(filepath, "rb") as file:
+        header_size = len(file.readline())
+
+        boundaries = [header_size]
+        for shard_index in range(1, shard_count):
+            # buscamos el primer inicio de línea desde el corte objetivo
+            target = header_size + (size - header_size) * shard_index // shard_count
+            file.seek(max(target - 1, header_size))
+            file.readline()
+            boundary = file.tell()
+            if boundaries[-1] < boundary < size:
+                boundaries.append(boundary)
+        boundaries.append(size)
+
+    return [
+        FileShard(filepath, shard_index, header_size, start, end)
+        for shard_index, (start, end) in enumerate(zip(boundaries[:-1], boundaries[1:]))
+        if end > start
+    ]
+
+
+@contextmanager
+def open_file_source(filepath: Union[Path, RemoteFileSource, FileShard]):
+    """ Función que abre la fuente de un archivo: una ruta local se entrega tal cual a pandas y un archivo
+    remoto (o un fragmento de archivo) se abre como stream para parsearlo conforme llegan los bytes """
+    if isinstance(filepath, (RemoteFileSource, FileShard)):
+        with filepath.open_stream() as stream:
+            yield stream
+    else:
+        yield filepath
+
+
+def schema_reader_options(extra_columns: Optional[set] = None) -> Dict[str, Any]:
+    """ Función que construye las opciones de pd.read_csv a partir del layout (VALID_COLUMNS) y de los tipos de
+    COLUMNS_DATA_TYPES: columnas a leer, tipos por columna y centinelas de nulos (fuera de las fechas). Las columnas
+    descartadas por no pertenecer al layout se agregan a 'extra_columns' """
+    valid_columns = set(VALID_COLUMNS)
+
+    def keep_column(column: str) -> bool:
+        if column in valid_columns:
+            return True
+        if extra_columns is not None:
+            extra_columns.add(column)     # pandas puede evaluar la misma columna más de una vez
+        return False
+
+    return {
+        "usecols": keep_column,
+        "dtype": {column: READER_DTYPES[datatype] for column, datatype in COLUMNS_DATA_TYPES.items()},
+        "na_values": {column: NA_SENTINELS for column in NA_SENTINEL_COLUMNS}
+    }
+
 
-def validate_file_loading(filepath: Path, logger: logging.Logger) -> Optional[pd.DataFrame]:
+def apply_na_sentinels(file_df: pd.DataFrame) -> pd.DataFrame:
+    """ Función que convierte a nulos los centinelas de las columnas leídas como texto y les da su tipo del esquema.
+    Sólo la usa el motor pyarrow, que no acepta centinelas por columna """
+    for column in NA_SENTINEL_COLUMNS:
+        values = file_df[column]
+        file_df[column] = values.mask(values.isin(NA_SENTINELS)).astype(READER_DTYPES[COLUMNS_DATA_TYPES[column]])
+    return file_df
+
+
+def read_report_csv(source: Any, logger: logging.Logger, chunksize: Optional[int] = None):
+    """ Función que lee un archivo de reporte ya tipado según el esquema. Con READER_ENGINE="pyarrow" los archivos
+    locales se parsean en paralelo; los streams y la lectura por bloques usan siempre el motor "c" """
+    extra_columns = set()
+    options = schema_reader_options(extra_columns)
+
+    use_pyarrow = False
+    if READER_ENGINE == "pyarrow" and chunksize is None and isinstance(source, (str, Path)):
+        if PYARROW_AVAILABLE:
+            # el motor pyarrow necesita la lista explícita de columnas, la tomamos del encabezado. Tampoco acepta
+            # centinelas por columna: las columnas con centinelas se leen como texto y se tipan después
+            header = list(pd.read_csv(source, nrows=0).columns)
+            extra_columns.update(column for column in header if column not in VALID_COLUMNS)
+            options["usecols"] = [column for column in header if column in VALID_COLUMNS]
+            options["dtype"] = {column: "object" for column in COLUMNS_DATA_TYPES}
+            options["na_values"] = None
+            options["engine"] = "pyarrow"
+            use_pyarrow = True
+        else:
+            logger.warning("Advertencia: pyarrow no está instalado, se usa el motor de lectura 'c'")
+
+    result = pd.read_csv(source, chunksize=chunksize, **options)
+    if use_pyarrow and set(NA_SENTINEL_COLUMNS) <= set(result.columns):
+        result = apply_na_sentinels(result)
+
+    # las columnas fuera del layout no se cargan en memoria (con el motor "c" se conocen al leer el encabezado,
+    # también en la lectura por bloques)
+    if extra_columns:
+        logger.warning(f"Advertencia: Se ignoran columnas adicionales del archivo: {sorted(extra_columns)}")
+
+    return result
+
+
+def validate_file_loading(filepath: Union[Path, RemoteFileSource], logger: logging.Logger) -> Optional[pd.DataFrame]:
     """ Función que valida que un archivo se pueda cargar como un dataframe de pandas y que no esté vacío"""
     # leemos el archivo
-    df = pd.read_csv(filepath)
+    with open_file_source(filepath) as source:
+        df = read_report_csv(source, logger)
 
     # validamos que no esté vacío   
     if df.empty:
         logger.warning("Alerta: El archivo se encuentra vacío")
+    elif COMPACT_DTYPES:
+        df = compact_dataframe(df, logger)
     
     return df
 
 
+def iter_file_chunks(filepath: Union[Path, RemoteFileSource], logger: logging.Logger, chunksize: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """ Función que lee un archivo en bloques acotados de registros, sin cargarlo completo en memoria """
+    with open_file_source(filepath) as source, read_report_csv(source, logger, chunksize) as reader:
+        for chunk_df in reader:
+            yield compact_dataframe(chunk_df, logger) if COMPACT_DTYPES else chunk_df
+
+
+def memory_footprint_mb(df: pd.DataFrame) -> float:
+    """ Función que calcula la memoria que ocupa un dataframe en MB, incluyendo el contenido de los strings """
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
+
+
+def compact_dataframe(file_df: pd.DataFrame, logger: logging.Logger) -> pd.DataFrame:
+    """ Función que convierte un dataframe recién leído a su representación compacta: categóricos para las columnas
+    de texto con pocos valores, strings de Arrow para el resto del texto y el entero nullable más pequeño posible
+    para los contadores. Reporta la memoria del archivo antes y después de la conversión """
+    before_mb = memory_footprint_mb(file_df)
+
+    for column, datatype in COLUMNS_DATA_TYPES.items():
+        if column not in file_df.columns:
+            continue
+
+        if column in CATEGORICAL_COLUMNS:
+            file_df[column] = file_df[column].astype("category")
+        elif datatype == "str" and PYARROW_AVAILABLE:
+            file_df[column] = file_df[column].astype("string[pyarrow]")
+        elif datatype == "int":
+            # Int64 -> Int8/Int16/... según el rango de valores, conservando los nulos
+            file_df[column] = pd.to_numeric(file_df[column], downcast="integer")
+
+    after_mb = memory_footprint_mb(file_df)
+    logger.info(f"Memoria del archivo: {before_mb:.2f} MB -> {after_mb:.2f} MB en representación compacta")
+
+    return file_df
+
+
+def strip_text_column(values: pd.Series) -> pd.Series:
+    """ Función que quita espacios en los extremos de una columna de texto conservando los nulos; en columnas
+    categóricas sólo se normalizan las categorías """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        stripped = values.cat.categories.str.strip()
+        if stripped.is_unique:
+            return values.cat.rename_categories(stripped)
+        # dos categorías se vuelven la misma al normalizarlas, las recodificamos
+        return values.astype(object).str.strip().astype("category")
+
+    return values.str.strip()
+
+
 def validate_file_layout(file_df: pd.DataFrame,  logger: logging.Logger) -> bool:
     """ Función que valida que un archivo cumpla con el formato de layout esperado """
-    # creamos una copia del dataframe original por buenas prácticas
-    file_copy = file_df.copy()
-
-    # convertimos el conjunto de columnas del archivo en un set
-    file_columns_set = set(file_copy.columns)
+    # convertimos el conjunto de columnas del archivo en un set (sólo se necesitan los nombres, no los datos)
+    file_columns_set = set(file_df.columns)
 
     # validación de columnas esperadas
     logger.info("Validando columnas esperadas")
@@ -91,116 +375,117 @@ def validate_file_layout(file_df: pd.DataFrame,  logger: logging.Logger) -> bool
         
         return False
     
-    # validando que existan columnas extra
-    logger.info("Validando presencia de columnas adicionales")
-    extra_columns = file_columns_set - valid_columns
-    if extra_columns:
-        # se lanza una advertencia
-        logger.warning("Advertencia: Se han encontrado columnas adicionales en el archivo")
-    
+    # las columnas adicionales no llegan hasta aquí: read_report_csv las descarta y las reporta al leer el archivo
     return True
 
 
+@functools.lru_cache(maxsize=EMAIL_CACHE_SIZE)
+def is_valid_email(email: str) -> bool:
+    """ Función que valida el formato de un email con el patrón precompilado, guardando el veredicto en caché """
+    return EMAIL_PATTERN.match(email) is not None
+
+
+def validate_email_column(emails: pd.Series) -> pd.Series:
+    """ Función que valida una columna de emails: el patrón se evalúa una sola vez por email distinto y los
+    veredictos se guardan en caché entre bloques y archivos """
+    # agrupamos los emails distintos (los nulos quedan con código -1) y normalizamos sólo esos
+    codes, uniques = pd.factorize(emails)
+    verdicts = np.fromiter((is_valid_email(str(email).strip()) for email in uniques), dtype=bool, count=len(uniques))
+
+    # expandimos el veredicto a todos los registros; un nulo nunca es válido
+    matches = np.append(verdicts, False)[codes]
+    return pd.Series(matches, index=emails.index)
+
+
+def date_format_mask(normalized: pd.Series) -> np.ndarray:
+    """ Función que revisa el formato 'dd/mm/YYYY HH:MM' de fechas ya normalizadas revisando cada posición de
+    carácter de forma vectorizada (sin expresiones regulares) """
+    # matriz (registros x 17) de códigos de carácter; un carácter extra permite detectar textos más largos que 16
+    chars = normalized.to_numpy().astype(f"U{DATE_WIDTH + 1}").view(np.uint32).reshape(-1, DATE_WIDTH + 1).astype(np.int32)
+    digits = chars - ord("0")
+    is_digit = (digits >= 0) & (digits <= 9)
+
+    day = digits[:, 0] * 10 + digits[:, 1]
+    month = digits[:, 3] * 10 + digits[:, 4]
+    hour = digits[:, 11] * 10 + digits[:, 12]
+    minute = digits[:, 14] * 10 + digits[:, 15]
+
+    return (
+        (chars[:, DATE_WIDTH] == 0) &   # ancho fijo de 16 caracteres
+        is_digit[:, 0] & is_digit[:, 1] & is_digit[:, 3] & is_digit[:, 4] &
+        is_digit[:, 6] & is_digit[:, 7] & is_digit[:, 8] & is_digit[:, 9] &
+        is_digit[:, 11] & is_digit[:, 12] & is_digit[:, 14] & is_digit[:, 15] &
+        (chars[:, 2] == ord("/")) & (chars[:, 5] == ord("/")) & (chars[:, 13] == ord(":")) &
+        np.isin(chars[:, 10], [ord(c) for c in " \t\n\r\f\v"]) &
+        (day >= 1) & (day <= 31) &
+        (month >= 1) & (month <= 12) &
+        (hour <= 23) &
+        (minute <= 59)
+    )
+
+
+def parse_date_column(dates: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    """ Función que valida y tipa una columna de fechas con un solo parseo de formato explícito (día primero).
+    Regresa la columna tipada y la máscara de validez; los nulos se consideran válidos """
+    normalized = dates.astype(str).str.strip()
+
+    # sólo parseamos los textos con el formato exacto; las fechas imposibles (ej. 31/02) quedan como NaT
+    well_formed = date_format_mask(normalized)
+    parsed = pd.to_datetime(normalized.where(well_formed), format=DATE_FORMAT, errors="coerce")
+
+    return parsed, dates.isna() | parsed.notna()    # null o nan es válido en este caso
+
+
 def validate_data_quality(file_df: pd.DataFrame, logger: logging.Logger) -> Tuple[pd.DataFrame, pd.DataFrame]:
-    """Función que valida la calidad de los datos con base al mail y los formatos de fecha"""
-    # creamos una copia del dataframe original por buenas prácticas
-    file_df_copy = file_df.copy()
-    
+    """Función que valida la calidad de los datos con base al mail y los formatos de fecha. Para no duplicar el
+    archivo en memoria las fechas se tipan sobre el mismo dataframe y las validaciones se guardan como máscaras
+    aparte; cada registro se copia una sola vez, a la partición de válidos o a la de errores (sólo email y tipo
+    de error) """
     # validación del formato del mail
     logger.info("Validando formato de email")
-    email_pattern = r"^[a-zA-Z0-9][a-zA-Z0-9._%+-]*@[a-zA-Z0-9]([a-zA-Z0-9-]*[a-zA-Z0-9])?(\.[a-zA-Z0-9]([a-zA-Z0-9-]*[a-zA-Z0-9])?)*\.[a-zA-Z]{2,}$"
-    file_df_copy["valid_email"] = (
-        file_df_copy["email"].notna() &  # no es nulo
-        file_df_copy["email"].astype(str).str.strip().ne("") &  # no está vacío
-        file_df_copy["email"].astype(str).str.strip().str.match(email_pattern, na=False)
-    )
+    valid_masks = {"Email": validate_email_column(file_df["email"])}
     
     # validación de formato de fechas
     logger.info("Validando formato de fechas")
-    date_pattern = r"^(0[1-9]|[12][0-9]|3[01])/(0[1-9]|1[0-2])/\d{4}\s([01][0-9]|2[0-3]):[0-5][0-9]$"
     for column_name in DATE_COLUMNS:
-        file_df_copy[f"valid_{column_name}"] = (
-            file_df_copy[column_name].isna() |  # null o nan es válido en este caso
-            (
-                file_df_copy[column_name].notna() & 
-                file_df_copy[column_name].astype(str).str.strip().ne("") &
-                file_df_copy[column_name].astype(str).str.strip().str.match(date_pattern, na=False)
-            )
-        )
-    
-    file_df_copy["valid_dates"] = file_df_copy[[f"valid_{c}" for c in DATE_COLUMNS if c in file_df_copy.columns]].all(axis=1)
+        # el mismo parseo sirve como validación y como columna tipada para prepare_data
+        file_df[column_name], valid_masks[column_name] = parse_date_column(file_df[column_name])
     
     # separamos los dataframes en registros validos/no válidos
-    file_df_copy["is_valid"] = file_df_copy["valid_email"] & file_df_copy["valid_dates"]
-    file_df_copy_ok = file_df_copy[file_df_copy["is_valid"]].copy()
-    file_df_copy_err = file_df_copy[~file_df_copy["is_valid"]].copy()
-    
-    # agregar el tipo de error en caso de fallo de alguna validación
-    if len(file_df_copy_err) > 0:
-        # Lista para almacenar los registros expandidos con un error por fila
-        expanded_errors = []
-        
-        for idx, row in file_df_copy_err.iterrows():
-            # Identificar qué validaciones fallaron
-            errors_found = []
-            
-            # Verificar email
-            if not row["valid_email"]:
-                errors_found.append("Email")
-            
-            # Verificar cada fecha
-            if not row.get("valid_Fecha envio", True):
-                errors_found.append("Fecha envio")
-            
-            if not row.get("valid_Fecha open", True):
-                errors_found.append("Fecha open")
-            
-            if not row.get("valid_Fecha click", True):
-                errors_found.append("Fecha click")
-            
-            # Crear un registro por cada error encontrado
-            for error_type in errors_found:
-                error_row = row.copy()
-                error_row["tipoError"] = error_type
-                expanded_errors.append(error_row)
-        
-        # Convertir la lista de errores a DataFrame
-        file_df_copy_err = pd.DataFrame(expanded_errors)
-        
-        # Limpiar columnas auxiliares de validación
-        validation_cols = ["valid_email", "valid_dates", "is_valid"] + \
-                         [f"valid_{c}" for c in DATE_COLUMNS if f"valid_{c}" in file_df_copy_err.columns]
-        file_df_copy_err = file_df_copy_err.drop(columns=validation_cols, errors='ignore')
+    is_valid = functools.reduce(operator.and_, valid_masks.values())
+    file_ok_df = file_df.take(np.flatnonzero(is_valid))   # take: copia propia, no una vista ligada al original
     
-    # Limpiar columnas auxiliares del DataFrame de registros válidos
-    validation_cols = ["valid_email", "valid_dates", "is_valid"] + \
-                     [f"valid_{c}" for c in DATE_COLUMNS if f"valid_{c}" in file_df_copy_ok.columns]
-    file_df_copy_ok = file_df_copy_ok.drop(columns=validation_cols, errors='ignore')
+    # agregar el tipo de error en caso de fallo de alguna validación: un registro por cada validación fallida
+    # (en el orden en que se reportan), filtrando con las máscaras de forma columnar
+    emails = file_df["email"]
+    expanded_errors = [
+        emails[~valid_mask].to_frame().assign(tipoError=error_type)
+        for error_type, valid_mask in valid_masks.items()
+    ]
+
+    # orden estable por índice original para conservar los errores de cada registro juntos y en orden
+    file_err_df = pd.concat(expanded_errors).sort_index(kind="stable")
     
     # logging de resultados de validación
     total_records = len(file_df)
-    valid_records_count = len(file_df_copy_ok)
-    invalid_records_count = len(file_df_copy_err)
-    unique_error_records = len(file_df_copy[~file_df_copy["is_valid"]])  # registros únicos con error
+    valid_records_count = len(file_ok_df)
+    invalid_records_count = len(file_err_df)
+    unique_error_records = total_records - valid_records_count  # registros únicos con error
     
     logger.info(f"Total de registros: {total_records}")
     logger.info(f"Registros válidos: {valid_records_count} ({valid_records_count/total_records*100:.2f}%)")
     logger.info(f"Registros con errores (únicos): {unique_error_records} ({unique_error_records/total_records*100:.2f}%)")
     logger.info(f"Total de errores desglosados: {invalid_records_count}")
 
-    return file_df_copy_ok, file_df_copy_err
-
+    return file_ok_df, file_err_df
 
-def prepare_data(filename: str, file_ok_df: pd.DataFrame, file_err_df: pd.DataFrame, logger: logging.Logger) -> Tuple(pd.DataFrame, pd.DataFrame):
-    """ Función para hacer las correcciones necesarias para dejar listas las tablas, previo a la carga """
-    # normalizamos los valores null/nan en los datos
-    logger.info("Normalizando elementos nulos")
-    file_ok_df = file_ok_df.replace(["-", "0", 0], np.nan)
-    file_err_df =  file_err_df.replace(["-", "0", 0], np.nan)
 
+def prepare_data(filename: str, file_ok_df: pd.DataFrame, file_err_df: pd.DataFrame, logger: logging.Logger) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """ Función para hacer las correcciones necesarias para dejar listas las tablas, previo a la carga. Las
+    particiones se ajustan en su lugar: 'estadisticas' es la misma partición de válidos, sin copiarla """
+    # los centinelas de nulos ('-', '0') ya se normalizaron al leer el archivo (ver NA_SENTINELS)
     # renombramos columnas
-    file_ok_df.rename(columns=COLUMNS_TO_MAP, axis=1, inplace=True)
-    file_err_df.rename(columns=COLUMNS_TO_MAP, axis=1, inplace=True)
+    file_ok_df.rename(columns=COLUMNS_TO_MAP, inplace=True)
 
     # inicializamos tablas
     stats_df = pd.DataFrame()
@@ -208,39 +493,320 @@ def prepare_data(filename: str, file_ok_df: pd.DataFrame, file_err_df: pd.DataFr
     errors_df = pd.DataFrame()
 
     # aseguramos el tipo de datos
-    for column, datatype, in COLUMNS_DATA_TYPES.items():
+    for raw_column, datatype, in COLUMNS_DATA_TYPES.items():
+        column = COLUMNS_TO_MAP[raw_column]     # las columnas ya fueron renombradas
         if datatype == "str":
-            file_ok_df[column] = file_ok_df[column].astype(str).str.strip()
-            file_err_df[column] = file_err_df[column].astype(str).str.strip()
+            # los nulos se conservan como nulos (NULL en la base) en lugar del texto 'nan'
+            file_ok_df[column] = strip_text_column(file_ok_df[column])
         
         elif datatype == "datetime":
-            file_ok_df[column] = pd.to_datetime(file_ok_df[column], errors="coerce")
-            file_err_df[column] = pd.to_datetime(file_err_df[column], errors="coerce")
+            # las fechas ya llegan tipadas desde validate_data_quality; sólo se parsean si no lo están
+            if not pd.api.types.is_datetime64_any_dtype(file_ok_df[column]):
+                file_ok_df[column] = pd.to_datetime(file_ok_df[column], format=DATE_FORMAT, errors="coerce")
         
         elif datatype == "int":
-            file_ok_df[column] = pd.to_numeric(file_ok_df[column], errors="coerce").astype(int)
-            file_err_df[column] = pd.to_numeric(file_err_df[column], errors="coerce").astype(int)
+            # los enteros ya llegan tipados desde la lectura; sólo se convierten si no lo están (Int64 admite nulos)
+            if not pd.api.types.is_integer_dtype(file_ok_df[column]):
+                file_ok_df[column] = pd.to_numeric(file_ok_df[column], errors="coerce").astype("Int64")
+
+    # descartamos los registros repetidos dentro del archivo o ya cargados desde otro archivo; quedan en 'errores'
+    # para que la bitácora siga cuadrando con los registros del archivo
+    if DEDUPLICATE_ROWS and not file_ok_df.empty:
+        file_ok_df, duplicates_err_df = drop_duplicate_rows(filename, file_ok_df, logger)
+        if not duplicates_err_df.empty:
+            file_err_df = pd.concat([file_err_df, duplicates_err_df]).sort_index(kind="stable")
 
     # preparando la tabla de estadísticas
     logger.info("Preparando tabla 'estadísticas'")
-    stats_df = file_ok_df.copy()    # copiamos directamente el dataframe de registros válidos
+    stats_df = file_ok_df    # usamos directamente el dataframe de registros válidos
 
     # creamos una tabla de visitantes temporal (basado en registros de este archivo)
-    visitors_df = file_ok_df.groupby("email").agg(
+    visitors_df = build_visitors_df(file_ok_df)
+
+    # preparando la tabla de errores
+    if not file_err_df.empty:
+        logger.info("Preparando tabla 'errores'")
+        file_err_df.insert(0, "nombreArchivo", filename)
+        file_err_df["email"] = strip_text_column(file_err_df["email"])
+        errors_df = file_err_df
+
+    return stats_df, visitors_df, errors_df
+
+
+def row_hashes(df: pd.DataFrame) -> np.ndarray:
+    """ Función que calcula un hash de 128 bits por registro (dos hashes vectorizados de pandas con distinta llave,
+    una columna cada uno) sobre los datos ya normalizados, así los registros idénticos tienen el mismo hash sin
+    importar su posición """
+    return np.column_stack([
+        pd.util.hash_pandas_object(df, index=False).to_numpy(),
+        pd.util.hash_pandas_object(df, index=False, hash_key=ROW_HASH_KEY).to_numpy()
+    ]).astype("<u8")
+
+
+def drop_duplicate_rows(filename: str, file_ok_df: pd.DataFrame, logger: logging.Logger) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """ Función que descarta los registros repetidos dentro del archivo y los que ya se cargaron antes (índice de hashes
+    del manifiesto), y regresa también los errores de los descartados para registrarlos en la tabla 'errores'. Los
+    hashes nuevos quedan pendientes y se confirman cuando el archivo termina de cargarse """
+    hashes = row_hashes(file_ok_df)
+
+    # duplicados dentro del archivo (comparando los dos enteros del hash de forma vectorizada)
+    duplicated = pd.DataFrame(hashes).duplicated().to_numpy()
+
+    # registros ya vistos (los nuevos quedan registrados como pendientes en la misma transacción); los hashes se
+    # manejan como bytes sólo para el índice
+    candidates = np.flatnonzero(~duplicated)
+    candidate_hashes = hashes[candidates].view("V16").ravel().tolist()
+    seen = claim_rows(filename, candidate_hashes)
+    if seen:
+        seen_mask = np.fromiter((row_hash in seen for row_hash in candidate_hashes), dtype=bool, count=len(candidate_hashes))
+        duplicated[candidates[seen_mask]] = True
+
+    duplicates_err_df = file_ok_df["email"].take(np.flatnonzero(duplicated)).to_frame().assign(tipoError=DUPLICATE_ROW_ERROR)
+    if duplicated.any():
+        logger.warning(f"Advertencia: Se descartan {int(duplicated.sum())} registros duplicados")
+        file_ok_df = file_ok_df.take(np.flatnonzero(~duplicated))
+
+    return file_ok_df, duplicates_err_df
+
+
+def build_visitors_df(file_ok_df: pd.DataFrame) -> pd.DataFrame:
+    """ Función que agrega los registros válidos por email para formar la tabla temporal de visitantes """
+    visitors_df = file_ok_df.groupby("email", as_index=False).agg(
         visitasTotales=("email", "count"),
         visitasAnioActual=("email", "count"),
         visitasMesActual=("email", "count")
     )
-    visitors_df["fechaPrimeraVisita"] = datetime.date.today().strftime('%d%m%y')
-    visitors_df["fechaUltimaVisita"] = datetime.date.today().strftime('%d%m%y')
+    # usamos fechas (no texto) para poder combinar agregados parciales con min/max
+    visitors_df["fechaPrimeraVisita"] = datetime.date.today()
+    visitors_df["fechaUltimaVisita"] = datetime.date.today()
 
+    return visitors_df
 
-    # preparando la tabla de errores
-    if not file_err_df.empty:
-        logger.info("Preparando tabla 'errores'")
-        file_err_df["nombreArchivo"] = filename
-        errors_df = file_err_df[["nombreArchivo", "email", "tipoError"]].copy()
+
+def merge_visitors_partials(partials: List[pd.DataFrame]) -> pd.DataFrame:
+    """ Función que combina agregados parciales de visitantes (por bloque o por archivo) en una sola tabla por email """
+    visitors_df = pd.concat(partials, ignore_index=True)
+
+    # min/max sobre objetos date no tiene ruta vectorizada en pandas; agregamos las fechas como datetime64
+    for column in ["fechaPrimeraVisita", "fechaUltimaVisita"]:
+        visitors_df[column] = pd.to_datetime(visitors_df[column])
+
+    # sumamos los conteos y conservamos la primera/última visita de cada email
+    visitors_df = visitors_df.groupby("email", as_index=False).agg(
+        visitasTotales=("visitasTotales", "sum"),
+        visitasAnioActual=("visitasAnioActual", "sum"),
+        visitasMesActual=("visitasMesActual", "sum"),
+        fechaPrimeraVisita=("fechaPrimeraVisita", "min"),
+        fechaUltimaVisita=("fechaUltimaVisita", "max")
+    )
+    for column in ["fechaPrimeraVisita", "fechaUltimaVisita"]:
+        visitors_df[column] = visitors_df[column].dt.date
+
+    return visitors_df
+
+
+def transform_file_in_chunks(filepath: Union[Path, RemoteFileSource], filename: str, logger: logging.Logger, chunksize: int = CHUNK_SIZE) -> Iterator[Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]]:
+    """ Función que valida y prepara un archivo por bloques, generando por cada bloque las filas de 'estadisticas',
+    'errores' y el agregado parcial de visitantes """
+    chunk_number = 0
+    for chunk_df in iter_file_chunks(filepath, logger, chunksize):
+        chunk_number += 1
+        logger.info(f"Procesando bloque {chunk_number} ({len(chunk_df)} registros)")
+
+        # el layout sólo se valida con el primer bloque, los demás comparten encabezado
+        if chunk_number == 1 and not validate_file_layout(chunk_df, logger):
+            raise ValueError(f"El layout del archivo {filename} no concuerda con el esperado")
+
+        # validamos y preparamos el bloque
+        chunk_ok_df, chunk_err_df = validate_data_quality(chunk_df, logger)
+        stats_df, visitors_df, errors_df = prepare_data(filename, chunk_ok_df, chunk_err_df, logger)
+        yield stats_df, visitors_df, errors_df
+
+    # validamos que el archivo tuviera registros
+    if chunk_number == 0:
+        logger.warning("Alerta: El archivo se encuentra vacío")
+
+
+def transform_file(filepath: Union[Path, RemoteFileSource, FileShard], logger: logging.Logger) -> Optional[Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]]:
+    """ Función que lee, valida y prepara un archivo completo, regresando las tablas 'estadisticas', 'visitantes' y
+    'errores'. Regresa None si el archivo está vacío o su layout no es el esperado """
+    # extraemos el nombre del archivo 
+    filename = filepath.name
+
+    # intentamos abrimos el archivo 
+    logger.info(f"Abriendo el archivo {filename}...")
+    file_df = validate_file_loading(filepath, logger)
+
+    # comprobamos que el archivo no esté vacío
+    if not file_df.empty:
+        # validamos el layout del archivo
+        logger.info("Validando el layout del archivo...")
+        valid_layout = validate_file_layout(file_df, logger)
+        
+        # si el layout es válido, continuamos
+        if valid_layout:
+            # validamos la calidad de los datos
+            logger.info("Validando la calidad de los datos...")
+            file_ok_df, file_err_df = validate_data_quality(file_df, logger)
+
+            # preparamos los datos para la carga
+            logger.info("Preparando datos para la carga...")
+            return prepare_data(filename, file_ok_df, file_err_df, logger)
+    
+    logger.warning("Alerta: Este archivo está vacío")
+    return None
+
+
+def merge_tables(tables_list: List[Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]]) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """ Función que junta las tablas de varias partes (fragmentos de un archivo o archivos de un micro-lote) en una
+    sola carga: concatena 'estadisticas' y 'errores' en orden y combina los agregados parciales de visitantes """
+    stats_parts = [stats_df for stats_df, _, _ in tables_list if not stats_df.empty]
+    visitors_parts = [visitors_df for _, visitors_df, _ in tables_list if not visitors_df.empty]
+    errors_parts = [errors_df for _, _, errors_df in tables_list if not errors_df.empty]
+
+    stats_df = pd.concat(stats_parts, ignore_index=True) if stats_parts else pd.DataFrame()
+    visitors_df = merge_visitors_partials(visitors_parts) if visitors_parts else pd.DataFrame()
+    errors_df = pd.concat(errors_parts, ignore_index=True) if errors_parts else pd.DataFrame()
 
     return stats_df, visitors_df, errors_df
 
 
+def combine_file_tables(tables_by_file: Dict[str, Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]]) -> Tuple[Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame], Dict[str, Tuple[int, int]]]:
+    """ Función que junta las tablas de los archivos de un micro-lote (cada error conserva su 'nombreArchivo') y
+    regresa también los registros válidos e inválidos de cada archivo para su registro en 'bitacora' """
+    record_counts = {
+        filename: (len(stats_df), len(errors_df))
+        for filename, (stats_df, _, errors_df) in tables_by_file.items()
+    }
+
+    return merge_tables(list(tables_by_file.values())), record_counts
+
+
+def transform_file_to_stage(filepath: Union[Path, RemoteFileSource], cache_key: Optional[str]) -> Optional[Tuple[Path, Path, Path]]:
+    """ Función que transforma un archivo y guarda sus tablas en staging en formato Arrow. Es el punto de entrada de
+    los procesos worker: recibe y regresa sólo rutas, nunca dataframes """
+    logger = logging.getLogger(__name__)
+    tables = transform_file(filepath, logger)
+    if tables is None:
+        return None
+
+    logger.info("Guardando tablas de salida en formato Arrow")
+    return write_stage_outputs(filepath.name, cache_key, *tables)
+
+
+def transform_shard_to_stage(shard: FileShard) -> Optional[Tuple[Path, Path, Path]]:
+    """ Función que transforma un fragmento de archivo y guarda sus tablas en staging en formato Arrow, en un
+    directorio propio del fragmento. Es el punto de entrada de los procesos worker para archivos fragmentados """
+    logger = logging.getLogger(__name__)
+    tables = transform_file(shard, logger)
+    if tables is None:
+        return None
+
+    return write_stage_outputs(f"{shard.name}.parte{shard.index}", None, *tables)
+
+
+def transform_file_sharded(filepath: Path, logger: logging.Logger, shard_count: int = SHARD_COUNT) -> Optional[Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]]:
+    """ Función que transforma un archivo grande partido en fragmentos que se validan y preparan en paralelo (en el
+    pool de procesos con TRANSFORM_EXECUTOR="process", o en hilos), y junta sus tablas en una sola salida para una
+    carga atómica. Regresa None si algún fragmento no se pudo transformar (archivo vacío o layout inválido) """
+    shards = split_file_shards(filepath, shard_count)
+    if not shards:
+        # sin filas de datos no hay fragmentos; la transformación normal reporta el archivo vacío
+        return transform_file(filepath, logger)
+
+    logger.info(f"Transformando el archivo {filepath.name} en {len(shards)} fragmentos en paralelo")
+
+    use_processes = TRANSFORM_EXECUTOR == "process" and PYARROW_AVAILABLE
+    try:
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            if use_processes:
+                futures = [executor.submit(run_in_process_pool, transform_shard_to_stage, shard, logger=logger) for shard in shards]
+            else:
+                futures = [executor.submit(transform_file, shard, logger) for shard in shards]
+            shard_results = [future.result() for future in futures]
+
+        if any(result is None for result in shard_results):
+            return None
+
+        # los procesos worker entregan rutas; leemos sus salidas antes de juntarlas
+        if use_processes:
+            shard_results = [tuple(read_stage_output(path) for path in paths) for paths in shard_results]
+
+        return merge_tables(shard_results)
+
+    finally:
+        if use_processes:
+            for shard in shards:
+                shutil.rmtree(stage_outputs_dir(f"{shard.name}.parte{shard.index}"), ignore_errors=True)
+
+
+def stage_outputs_dir(filename: str) -> Path:
+    """ Función que regresa el directorio de las salidas columnares de la transformación de un archivo """
+    return Path(DIR_STAGE_OUTPUTS) / f"{filename}.arrow"
+
+
+def transform_cache_key(filepath: Union[Path, RemoteFileSource]) -> Optional[str]:
+    """ Función que calcula la llave de caché de la transformación de un archivo: hash de su nombre (va en la tabla
+    'errores') y su contenido, combinado con la configuración de la transformación y la versión del código. Un
+    archivo remoto (modo stream) no tiene copia local que hashear y no se cachea """
+    if isinstance(filepath, RemoteFileSource):
+        return None
+
+    settings = ",".join(f"{name}={value}" for name, value in sorted(TRANSFORM_SETTINGS.items()))
+    return hashlib.sha256(f"{filepath.name}:{file_sha256(filepath)}:{settings}:{TRANSFORM_CODE_VERSION}".encode()).hexdigest()
+
+
+def purge_expired_stage_outputs(logger: logging.Logger) -> None:
+    """ Función que borra las salidas de transformación en staging que ya expiraron. Post-procesamiento borra las de
+    cada archivo procesado; éstas son de archivos que fallaron y no se volvieron a procesar dentro de su vigencia """
+    stage_dir = Path(DIR_STAGE_OUTPUTS)
+    if not stage_dir.is_dir():
+        return
+
+    for output_dir in stage_dir.glob("*.arrow"):
+        key_path = output_dir / STAGE_CACHE_KEY_FILE
+        if not key_path.exists() or time.time() - key_path.stat().st_mtime > STAGE_CACHE_EXPIRATION_HOURS * 3600:
+            logger.info(f"Borrando salidas de transformación expiradas: {output_dir}")
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def write_stage_outputs(filename: str, cache_key: Optional[str], stats_df: pd.DataFrame, visitors_df: pd.DataFrame, errors_df: pd.DataFrame) -> Tuple[Path, Path, Path]:
+    """ Función que guarda las tablas de salida de la transformación como archivos Arrow IPC sin compresión (legibles
+    con memory map) junto con su llave de caché, y regresa sus rutas. Se escriben en un directorio temporal que se
+    publica con un rename, así una salida a medio escribir nunca se reutiliza """
+    output_dir = stage_outputs_dir(filename)
+    tmp_dir = output_dir.with_name(output_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    for table_name, df in zip(STAGE_OUTPUT_TABLES, [stats_df, visitors_df, errors_df]):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        with pa.OSFile(str(tmp_dir / f"{table_name}.arrow"), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    (tmp_dir / STAGE_CACHE_KEY_FILE).write_text(cache_key or "")
+
+    # publicamos las salidas completas
+    shutil.rmtree(output_dir, ignore_errors=True)
+    tmp_dir.rename(output_dir)
+
+    return tuple(output_dir / f"{table_name}.arrow" for table_name in STAGE_OUTPUT_TABLES)
+
+
+def find_stage_outputs(filename: str, cache_key: Optional[str]) -> Optional[Tuple[Path, Path, Path]]:
+    """ Función que busca las salidas ya publicadas de una transformación anterior del archivo (por ejemplo, de un
+    intento del flujo cuya carga falló). Sólo se reutilizan si se generaron con la misma llave de caché (mismo
+    contenido y misma versión del código) y no han expirado """
+    output_dir = stage_outputs_dir(filename)
+    key_path = output_dir / STAGE_CACHE_KEY_FILE
+    if cache_key is None or not key_path.exists() or key_path.read_text() != cache_key:
+        return None
+
+    # validamos la vigencia de las salidas
+    if time.time() - key_path.stat().st_mtime > STAGE_CACHE_EXPIRATION_HOURS * 3600:
+        return None
+
+    output_paths = tuple(output_dir / f"{table_name}.arrow" for table_name in STAGE_OUTPUT_TABLES)
+    if all(path.exists() for path in output_paths):
+        return output_paths
+
+    return None